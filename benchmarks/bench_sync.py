@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+# Benchmarks end-to-end runs of the downloader (main() of vcv_plugindownloader.py) against a local stand-in for the Rack Web API,
+# which serves a synthetic plugin manifest and generated plugin archives. No network access required.
+#
+# Scenarios (run in this order in a fresh plugins directory):
+#   cold     - download and extract all plugins
+#   noop     - nothing changed, all plugins are up to date
+#   partial  - a fraction of the plugins was updated upstream
+#   delete   - delete all plugins
+#
+# Example:
+#   benchmarks/bench_sync.py --plugins 200 --size 512 --latency 20 -- --parallel-downloads 8
+
+import sys
+import os
+import io
+import json
+import time
+import random
+import hashlib
+import zipfile
+import argparse
+import tempfile
+import threading
+import contextlib
+import statistics
+import http.server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import vcv_plugindownloader
+
+PLATFORMS = ["win", "mac", "lin"]
+SCENARIOS = ["cold", "noop", "partial", "delete"]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the downloader against a local mock plugin API and archive server.")
+
+    parser.add_argument("-n", "--plugins", type=int, help="number of plugins in the manifest", default=50)
+    parser.add_argument("-s", "--size", type=int, help="size of the binary in each plugin archive in KiB", default=256)
+    parser.add_argument("-f", "--files", type=int, help="number of additional resource files in each plugin archive", default=20)
+    parser.add_argument("--latency", type=float, help="latency in milliseconds added to every request", default=0)
+    parser.add_argument("--failure-rate", type=float, help="probability that an archive download is interrupted halfway", default=0)
+    parser.add_argument("--update-fraction", type=float, help="fraction of plugins updated for the partial update scenario", default=0.1)
+    parser.add_argument("-r", "--repeat", type=int, help="number of times to run all scenarios (in a fresh plugins directory)", default=1)
+    parser.add_argument("--scenarios", nargs='+', choices=SCENARIOS, help="scenarios to run", default=SCENARIOS)
+    parser.add_argument("--json", type=str, help="write the results as JSON to the given file")
+    parser.add_argument("-v", "--verbose", action='store_true', help="show the output of the downloader", default=False)
+    parser.add_argument("--seed", type=int, help="seed for generating archives and injecting failures", default=0)
+    parser.add_argument("downloader_args", nargs=argparse.REMAINDER, help="additional arguments passed to the downloader (after '--')")
+
+    args = parser.parse_args(argv)
+    if args.downloader_args and args.downloader_args[0] == "--":
+        args.downloader_args = args.downloader_args[1:]
+    return args
+
+
+def create_archive(slug, version, size, num_files, rng):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr(slug + "/", "")
+        z.writestr(slug + "/plugin.json", json.dumps({"slug": slug, "version": version}))
+        z.writestr(slug + "/plugin.so", rng.getrandbits(size * 1024 * 8).to_bytes(size * 1024, "little") if size else b"")
+        for i in range(num_files):
+            z.writestr("%s/res/module%d.svg" % (slug, i), "<svg><!-- %s %s %d --></svg>\n" % (slug, version, i) * 50)
+    return buffer.getvalue()
+
+
+class MockServer:
+    # Serves the manifest at /community/plugins and the archives at /archives/<file name>.
+    # Supports conditional manifest requests and range requests, like the real servers.
+
+    def __init__(self, options):
+        self.options = options
+        self.rng = random.Random(options.seed)
+        self.archives = {}
+        self.plugins = []
+        self.requests = 0
+        self.lock = threading.Lock()
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                server.handle(self, head=True)
+
+            def do_GET(self):
+                server.handle(self)
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = "http://127.0.0.1:%d" % self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def publish(self, slug, version):
+        data = create_archive(slug, version, self.options.size, self.options.files, self.rng)
+        downloads = {}
+        for platform in PLATFORMS:
+            file_name = "%s-%s-%s.zip" % (slug, version, platform)
+            self.archives[file_name] = data
+            downloads[platform] = {
+                "download": "%s/archives/%s?raw=true" % (self.url, file_name),
+                "sha256": hashlib.sha256(data).hexdigest()
+            }
+        return {"slug": slug, "name": slug, "version": version, "downloads": downloads}
+
+    def generate(self):
+        self.plugins = [self.publish("Bench%04d" % i, "0.6.0") for i in range(self.options.plugins)]
+        self.update_manifest()
+
+    def update(self, fraction):
+        # Publish a new version of a fraction of the plugins.
+        count = max(1, int(len(self.plugins) * fraction)) if fraction > 0 else 0
+        for i in sorted(self.rng.sample(range(len(self.plugins)), count)):
+            version = self.plugins[i]["version"].rsplit(".", 1)
+            self.plugins[i] = self.publish(self.plugins[i]["slug"], "%s.%d" % (version[0], int(version[1]) + 1))
+        self.update_manifest()
+        return count
+
+    def update_manifest(self):
+        self.manifest = json.dumps({"plugins": self.plugins}).encode("utf-8")
+        self.etag = '"%s"' % hashlib.sha256(self.manifest).hexdigest()[:32]
+
+    def handle(self, request, head=False):
+        with self.lock:
+            self.requests += 1
+        if self.options.latency:
+            time.sleep(self.options.latency / 1000.0)
+
+        path = request.path.split("?")[0]
+        if path == "/community/plugins":
+            if request.headers.get("If-None-Match") == self.etag:
+                request.send_response(304)
+                request.send_header("ETag", self.etag)
+                request.send_header("Content-Length", "0")
+                request.end_headers()
+                return
+            self.send(request, self.manifest, "application/json", head, {"ETag": self.etag})
+            return
+
+        data = self.archives.get(path[len("/archives/"):]) if path.startswith("/archives/") else None
+        if data is None:
+            request.send_error(404)
+            return
+
+        start = 0
+        range_header = request.headers.get("Range")
+        if range_header and range_header.startswith("bytes=") and range_header.endswith("-"):
+            start = int(range_header[len("bytes="):-1])
+            if start >= len(data):
+                request.send_response(416)
+                request.send_header("Content-Length", "0")
+                request.end_headers()
+                return
+
+        headers = {"Accept-Ranges": "bytes"}
+        if start:
+            headers["Content-Range"] = "bytes %d-%d/%d" % (start, len(data) - 1, len(data))
+        with self.lock:
+            interrupt = not head and self.rng.random() < self.options.failure_rate
+        self.send(request, data[start:], "application/zip", head, headers, 206 if start else 200, interrupt)
+
+    def send(self, request, body, content_type, head, headers=None, status=200, interrupt=False):
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            request.send_header(key, value)
+        request.end_headers()
+        if head:
+            return
+        if interrupt:
+            # Send half of the body and drop the connection.
+            request.wfile.write(body[:len(body) // 2])
+            request.close_connection = True
+            return
+        request.wfile.write(body)
+
+
+def load_downloader(plugins_dir, api_host):
+    # The download directory is resolved from the working directory at import time. Point it to the plugins directory.
+    vcv_plugindownloader.set_download_dir(os.path.join(plugins_dir, "downloads"))
+    vcv_plugindownloader.RACK_API_HOST = api_host
+    return vcv_plugindownloader
+
+
+def run_downloader(downloader, plugins_dir, argv, verbose):
+    cwd = os.getcwd()
+    os.chdir(plugins_dir)
+    output = io.StringIO()
+    try:
+        start = time.perf_counter()
+        if verbose:
+            exit_code = downloader.main(argv)
+        else:
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                exit_code = downloader.main(argv)
+        duration = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+    return exit_code, duration, output.getvalue()
+
+
+def run_scenarios(options, server):
+    results = []
+    # Revalidate the manifest on every run, as a real sync after the TTL expired would.
+    base_args = ["lin", "--manifest-ttl", "0", "--retry-backoff", "0.01"] + options.downloader_args
+
+    # Deleted plugins might still be being removed in the background when the directory is cleaned up.
+    with tempfile.TemporaryDirectory(prefix="vcv-bench-", ignore_cleanup_errors=True) as plugins_dir:
+        downloader = load_downloader(plugins_dir, server.url)
+        server.generate()
+
+        for scenario in options.scenarios:
+            argv = list(base_args)
+            detail = ""
+            if scenario == "partial":
+                detail = "%d plugins updated" % server.update(options.update_fraction)
+            elif scenario == "delete":
+                argv += ["--delete", "--yes"]
+
+            requests = server.requests
+            exit_code, duration, output = run_downloader(downloader, plugins_dir, argv, options.verbose)
+            results.append({
+                "scenario": scenario,
+                "seconds": duration,
+                "exit_code": exit_code,
+                "bytes": downloader.run_stats["bytes"],
+                "requests": server.requests - requests,
+                "detail": detail
+            })
+            if exit_code != 0 and not options.verbose:
+                print(output, file=sys.stderr)
+
+    return results
+
+
+def main(argv=None):
+    options = parse_args(argv)
+
+    server = MockServer(options)
+    server.start()
+    try:
+        runs = [run_scenarios(options, server) for _ in range(options.repeat)]
+    finally:
+        server.stop()
+
+    print("Plugins: %d, binary size: %d KiB, resource files: %d, latency: %g ms, failure rate: %g" % (
+        options.plugins, options.size, options.files, options.latency, options.failure_rate))
+    if options.downloader_args:
+        print("Downloader arguments: %s" % " ".join(options.downloader_args))
+    print("")
+    print("%-10s %10s %10s %12s %10s  %s" % ("SCENARIO", "MEDIAN [s]", "MIN [s]", "BYTES", "REQUESTS", "EXIT CODES"))
+
+    summary = []
+    for i, scenario in enumerate(options.scenarios):
+        samples = [run[i] for run in runs]
+        seconds = [s["seconds"] for s in samples]
+        entry = {
+            "scenario": scenario,
+            "median": statistics.median(seconds),
+            "min": min(seconds),
+            "bytes": samples[-1]["bytes"],
+            "requests": samples[-1]["requests"],
+            "exit_codes": [s["exit_code"] for s in samples],
+            "detail": samples[-1]["detail"]
+        }
+        summary.append(entry)
+        print("%-10s %10.3f %10.3f %12d %10d  %s %s" % (scenario, entry["median"], entry["min"], entry["bytes"], entry["requests"],
+                                                     ",".join(str(c) for c in entry["exit_codes"]), entry["detail"]))
+
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump({"options": {k: v for k, v in vars(options).items() if k != "json"}, "results": summary, "runs": runs}, f, indent=2)
+
+    return 0 if all(s["exit_code"] == 0 for run in runs for s in run) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,25 @@
+import os
+import sys
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import vcv_plugindownloader
+
+
+@pytest.fixture
+def downloader(tmp_path):
+    # Point the download directory (archive store, caches and indexes) to a temporary directory.
+    vcv_plugindownloader.set_download_dir(str(tmp_path / "downloads"))
+    vcv_plugindownloader.reset_run_stats()
+    yield vcv_plugindownloader
+    vcv_plugindownloader.set_download_dir(os.path.join(os.getcwd(), "downloads"))
+
+
+def create_archive(path, files):
+    # files maps member names to their contents (None for folders).
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, data in files.items():
+            z.writestr(name, "" if data is None else data)
+    return str(path)
@@ -0,0 +1,84 @@
+import os
+
+from conftest import create_archive
+
+V1 = {
+    "Plugin/": None,
+    "Plugin/plugin.so": "binary v1",
+    "Plugin/res/Module.svg": "<svg/>",
+    "Plugin/stale.txt": "removed in v2",
+}
+V2 = {
+    "Plugin/": None,
+    "Plugin/plugin.so": "binary v2",
+    "Plugin/res/Module.svg": "<svg/>",
+    "__MACOSX/Plugin/._plugin.so": "resource fork",
+}
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_extract_incremental_into_empty_dir(downloader, tmp_path):
+    plugins_dir = tmp_path / "plugins"
+    plugins_dir.mkdir()
+
+    written, unchanged = downloader.extract_incremental(create_archive(tmp_path / "v1.zip", V1), "Plugin", str(plugins_dir))
+
+    assert (written, unchanged) == (3, 0)
+    assert read(plugins_dir / "Plugin" / "plugin.so") == "binary v1"
+    assert sorted(os.listdir(plugins_dir)) == ["Plugin"]
+
+
+def test_extract_incremental_links_unchanged_and_removes_stale(downloader, tmp_path):
+    plugins_dir = tmp_path / "plugins"
+    plugins_dir.mkdir()
+    downloader.extract_incremental(create_archive(tmp_path / "v1.zip", V1), "Plugin", str(plugins_dir))
+    svg_inode = os.stat(plugins_dir / "Plugin" / "res" / "Module.svg").st_ino
+    so_inode = os.stat(plugins_dir / "Plugin" / "plugin.so").st_ino
+
+    written, unchanged = downloader.extract_incremental(create_archive(tmp_path / "v2.zip", V2), "Plugin", str(plugins_dir))
+
+    assert (written, unchanged) == (1, 1)
+    plugin_path = plugins_dir / "Plugin"
+    # The unchanged file is a hard link to the previous version, the changed one is a new file.
+    assert os.stat(plugin_path / "res" / "Module.svg").st_ino == svg_inode
+    assert os.stat(plugin_path / "plugin.so").st_ino != so_inode
+    assert read(plugin_path / "plugin.so") == "binary v2"
+    assert not (plugin_path / "stale.txt").exists()
+    # Members outside of the plugin root are extracted as usual, no staging or old directories are left behind.
+    assert (plugins_dir / "__MACOSX" / "Plugin" / "._plugin.so").exists()
+    assert sorted(os.listdir(plugins_dir)) == ["Plugin", "__MACOSX"]
+
+
+def test_extract_incremental_restores_interrupted_swap(downloader, tmp_path):
+    # An update that died between moving the current version aside and moving the staged version in.
+    plugins_dir = tmp_path / "plugins"
+    plugins_dir.mkdir()
+    downloader.extract_incremental(create_archive(tmp_path / "v1.zip", V1), "Plugin", str(plugins_dir))
+    os.rename(plugins_dir / "Plugin", plugins_dir / ".Plugin.old")
+    (plugins_dir / ".Plugin.staging").mkdir()
+    (plugins_dir / ".Plugin.staging" / "partial.txt").write_text("partial")
+
+    written, unchanged = downloader.extract_incremental(create_archive(tmp_path / "v2.zip", V2), "Plugin", str(plugins_dir))
+
+    # The previous version was restored first, so its unchanged file is reused.
+    assert (written, unchanged) == (1, 1)
+    assert read(plugins_dir / "Plugin" / "plugin.so") == "binary v2"
+    assert not (plugins_dir / "Plugin" / "partial.txt").exists()
+    assert sorted(os.listdir(plugins_dir)) == ["Plugin", "__MACOSX"]
+
+
+def test_extract_incremental_drops_old_dir_if_swap_completed(downloader, tmp_path):
+    plugins_dir = tmp_path / "plugins"
+    plugins_dir.mkdir()
+    downloader.extract_incremental(create_archive(tmp_path / "v1.zip", V1), "Plugin", str(plugins_dir))
+    (plugins_dir / ".Plugin.old").mkdir()
+    (plugins_dir / ".Plugin.old" / "plugin.so").write_text("binary v0")
+
+    downloader.extract_incremental(create_archive(tmp_path / "v2.zip", V2), "Plugin", str(plugins_dir))
+
+    assert read(plugins_dir / "Plugin" / "plugin.so") == "binary v2"
+    assert not (plugins_dir / ".Plugin.old").exists()
@@ -0,0 +1,184 @@
+import hashlib
+import os
+import time
+import types
+
+import pytest
+
+from conftest import create_archive
+
+DAY = 86400
+
+
+def store_archive(downloader, store_index, tmp_path, slug, version, installed=None, last_used=None, size=0):
+    # Put an archive of the given plugin version into the store, as a download would.
+    archive_file = create_archive(tmp_path / ("%s-%s.zip" % (slug, version)), {
+        slug + "/": None,
+        slug + "/plugin.json": '{"slug": "%s", "version": "%s"}' % (slug, version),
+        slug + "/padding.bin": "x" * size,
+    })
+    with open(archive_file, "rb") as f:
+        sha256 = hashlib.sha256(f.read()).hexdigest()
+    store_file = downloader.get_store_file(sha256)
+    os.makedirs(os.path.dirname(store_file), exist_ok=True)
+    os.replace(archive_file, store_file)
+    downloader.add_to_store(store_index, "lin", slug, version, sha256)
+    if installed is not None:
+        downloader.get_store_entry(store_index, "lin", slug)["versions"][sha256]["installed"] = installed
+    if last_used is not None:
+        store_index["archives"][sha256]["last_used"] = last_used
+    return sha256
+
+
+def set_current(store_index, slug, sha256):
+    store_index["plugins"]["lin"][slug]["current"] = sha256
+
+
+def stored(downloader, sha256):
+    return os.path.exists(downloader.get_store_file(sha256))
+
+
+@pytest.fixture
+def store_index(downloader):
+    return downloader.load_store_index()
+
+
+def test_gc_evicts_all_but_current_archives(downloader, store_index, tmp_path):
+    old = store_archive(downloader, store_index, tmp_path, "Plugin", "1.0.0", installed=1)
+    current = store_archive(downloader, store_index, tmp_path, "Plugin", "2.0.0", installed=2)
+    other = store_archive(downloader, store_index, tmp_path, "Other", "1.0.0")
+    set_current(store_index, "Plugin", current)
+
+    count, size = downloader.collect_garbage(store_index)
+
+    assert count == 2
+    assert size > 0
+    assert stored(downloader, current)
+    assert not stored(downloader, old) and not stored(downloader, other)
+    assert set(store_index["archives"]) == {current}
+    assert set(store_index["plugins"]["lin"]["Plugin"]["versions"]) == {current}
+    assert store_index["plugins"]["lin"]["Other"]["versions"] == {}
+
+
+def test_gc_max_age(downloader, store_index, tmp_path):
+    now = time.time()
+    old = store_archive(downloader, store_index, tmp_path, "Plugin", "1.0.0", last_used=now - 40 * DAY)
+    recent = store_archive(downloader, store_index, tmp_path, "Plugin", "2.0.0", last_used=now - 10 * DAY)
+    current = store_archive(downloader, store_index, tmp_path, "Plugin", "3.0.0", last_used=now - 90 * DAY)
+    set_current(store_index, "Plugin", current)
+
+    count, _ = downloader.collect_garbage(store_index, max_age=30)
+
+    assert count == 1
+    assert not stored(downloader, old)
+    assert stored(downloader, recent) and stored(downloader, current)
+
+
+def test_gc_max_size_evicts_least_recently_used(downloader, store_index, tmp_path):
+    now = time.time()
+    oldest = store_archive(downloader, store_index, tmp_path, "A", "1.0.0", last_used=now - 3 * DAY, size=4096)
+    older = store_archive(downloader, store_index, tmp_path, "B", "1.0.0", last_used=now - 2 * DAY, size=4096)
+    newer = store_archive(downloader, store_index, tmp_path, "C", "1.0.0", last_used=now - 1 * DAY, size=4096)
+    current = store_archive(downloader, store_index, tmp_path, "D", "1.0.0", last_used=now - 9 * DAY, size=4096)
+    set_current(store_index, "D", current)
+    sizes = {s: a["size"] for s, a in store_index["archives"].items()}
+
+    # Room for two archives: the current one stays, the least recently used of the others are evicted.
+    count, size = downloader.collect_garbage(store_index, max_size=sizes[current] + sizes[newer])
+
+    assert count == 2
+    assert size == sizes[oldest] + sizes[older]
+    assert stored(downloader, newer) and stored(downloader, current)
+    assert not stored(downloader, oldest) and not stored(downloader, older)
+
+
+def test_gc_removes_stale_files(downloader, store_index, tmp_path):
+    current = store_archive(downloader, store_index, tmp_path, "Plugin", "1.0.0")
+    set_current(store_index, "Plugin", current)
+    # An interrupted download and an archive that is not in the index.
+    part_file = downloader.get_store_file("ab" * 32) + ".part"
+    os.makedirs(os.path.dirname(part_file), exist_ok=True)
+    with open(part_file, "wb") as f:
+        f.write(b"partial")
+
+    count, _ = downloader.collect_garbage(store_index, max_size=10 ** 9)
+
+    # Within the size limit, but neither file is used by any plugin.
+    assert count == 0
+    count, _ = downloader.collect_garbage(store_index)
+    assert count == 1
+    assert not os.path.exists(part_file)
+    assert stored(downloader, current)
+
+
+def rollback(downloader, store_index, tmp_path, version=None):
+    plugins_dir = tmp_path / "plugins"
+    plugins_dir.mkdir(exist_ok=True)
+    options = types.SimpleNamespace(rollback=version, verify_all=False, incremental=False, buffer_size=64)
+    with open(os.devnull, "w") as out:
+        return downloader.rollback_binary({"slug": "Plugin"}, "lin", str(plugins_dir), options, {}, store_index, out)
+
+
+def installed_version(tmp_path):
+    with open(tmp_path / "plugins" / "Plugin" / "plugin.json") as f:
+        return f.read()
+
+
+@pytest.fixture
+def versions(downloader, store_index, tmp_path):
+    # 1.0.0 and 2.0.0 were installed before, 3.0.0 is current and 4.0.0 was downloaded but never installed.
+    shas = {
+        "1.0.0": store_archive(downloader, store_index, tmp_path, "Plugin", "1.0.0", installed=1),
+        "2.0.0": store_archive(downloader, store_index, tmp_path, "Plugin", "2.0.0", installed=2),
+        "3.0.0": store_archive(downloader, store_index, tmp_path, "Plugin", "3.0.0", installed=3),
+        "4.0.0": store_archive(downloader, store_index, tmp_path, "Plugin", "4.0.0"),
+    }
+    set_current(store_index, "Plugin", shas["3.0.0"])
+    return shas
+
+
+def test_rollback_to_previous_version(downloader, store_index, versions, tmp_path):
+    result = rollback(downloader, store_index, tmp_path)
+
+    assert result["updated"] and not result["error"]
+    assert downloader.get_current_archive(store_index, "lin", "Plugin") == versions["2.0.0"]
+    assert '"2.0.0"' in installed_version(tmp_path)
+
+
+def test_rollback_to_version(downloader, store_index, versions, tmp_path):
+    result = rollback(downloader, store_index, tmp_path, "1.0.0")
+
+    assert result["updated"]
+    assert downloader.get_current_archive(store_index, "lin", "Plugin") == versions["1.0.0"]
+    assert '"1.0.0"' in installed_version(tmp_path)
+
+
+def test_rollback_to_checksum_prefix(downloader, store_index, versions, tmp_path):
+    result = rollback(downloader, store_index, tmp_path, versions["4.0.0"][:12].upper())
+
+    assert result["updated"]
+    assert downloader.get_current_archive(store_index, "lin", "Plugin") == versions["4.0.0"]
+
+
+def test_rollback_to_current_version(downloader, store_index, versions, tmp_path):
+    result = rollback(downloader, store_index, tmp_path, "3.0.0")
+
+    assert result["installed"] and not result["updated"]
+    assert not (tmp_path / "plugins" / "Plugin").exists()
+
+
+def test_rollback_to_unknown_version(downloader, store_index, versions, tmp_path):
+    result = rollback(downloader, store_index, tmp_path, "5.0.0")
+
+    assert result["error"]
+    assert downloader.get_current_archive(store_index, "lin", "Plugin") == versions["3.0.0"]
+
+
+def test_rollback_to_evicted_version(downloader, store_index, versions, tmp_path):
+    os.remove(downloader.get_store_file(versions["2.0.0"]))
+
+    result = rollback(downloader, store_index, tmp_path)
+
+    # Archives no longer in the store are skipped.
+    assert result["updated"]
+    assert downloader.get_current_archive(store_index, "lin", "Plugin") == versions["1.0.0"]
@@ -0,0 +1,2547 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import json
+import glob
+import re
+import fnmatch
+import urllib.request
+import shutil
+import zipfile
+import hashlib
+import zlib
+import sysconfig
+import subprocess
+import argparse
+import traceback
+import getpass
+import time
+import random
+import datetime
+import cProfile
+import io
+import concurrent.futures
+import contextlib
+import threading
+import ssl
+import http.client
+import http.server
+import urllib.parse
+import urllib.error
+import asyncio
+import base64
+import functools
+import collections
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+__version__ = "2.7.0"
+
+MANIFEST_TTL = 300
+# Deleted plugins are moved here (within the plugins directory) and removed in the background.
+TRASH_DIR_NAME = ".vcv-plugindownloader-trash"
+PLATFORM_STRING = {"win": "Windows", "mac": "MacOS", "lin": "Linux"}
+RACK_API_HOST = "https://api.vcvrack.com"
+USER_AGENT = "vcv-plugindownloader/%s" % __version__
+
+# Idle keep-alive connections kept per host. Connections are shared by API requests and archive downloads.
+HTTP_POOL_SIZE = 4
+HTTP_MAX_REDIRECTS = 5
+DOWNLOAD_BUFFER_SIZE = 256 * 1024
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_RETRY_BACKOFF = 1.0
+DOWNLOAD_TIMEOUT = 60
+# Path under which a mirror (--serve) serves archives by their SHA256.
+MIRROR_ARCHIVE_PATH = "/archives/"
+
+_connection_pool = {}
+_connection_pool_lock = threading.Lock()
+_ssl_context = None
+connection_stats = {"opened": 0, "reused": 0}
+
+_git_cache_lock = threading.Lock()
+_git_cache_fetched = set()
+_git_cache_locks = {}
+_toolchain_fingerprint = None
+
+_store_lock = threading.Lock()
+_extract_lock = threading.Lock()
+_manifest_memo = None
+_archive_locks = {}
+
+# Timings, transferred bytes and cache hits/misses of the current run (see --report).
+_run_stats_lock = threading.Lock()
+
+
+def reset_run_stats():
+    global run_stats
+    with _run_stats_lock:
+        run_stats = {"started": time.time(), "phases": {}, "plugins": {}, "bytes": 0, "cache": {}}
+        connection_stats.update(opened=0, reused=0)
+
+
+reset_run_stats()
+
+
+def get_plugin_stats(slug):
+    return run_stats["plugins"].setdefault(slug, {"phases": {}, "bytes": 0})
+
+
+def record_time(phase, seconds, slug=None):
+    with _run_stats_lock:
+        total = run_stats["phases"].setdefault(phase, {"seconds": 0.0, "count": 0})
+        total["seconds"] += seconds
+        total["count"] += 1
+        if slug:
+            phases = get_plugin_stats(slug)["phases"]
+            phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+def record_bytes(num_bytes, slug=None):
+    with _run_stats_lock:
+        run_stats["bytes"] += num_bytes
+        if slug:
+            get_plugin_stats(slug)["bytes"] += num_bytes
+
+
+def record_cache(cache, hit):
+    with _run_stats_lock:
+        counts = run_stats["cache"].setdefault(cache, {"hit": 0, "miss": 0})
+        counts["hit" if hit else "miss"] += 1
+
+
+@contextlib.contextmanager
+def timed(phase, slug=None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_time(phase, time.perf_counter() - start, slug)
+
+
+def set_download_dir(download_dir):
+    # The download directory holds the archive store, the caches and indexes and the build logs.
+    # It defaults to "downloads" in the working directory at import time.
+    global DOWNLOAD_DIR, FAILED_CHECKSUM_DIR, MANIFEST_CACHE_FILE, HASH_INDEX_FILE, BUILD_LOG_DIR, GIT_CACHE_DIR
+    global BUILD_CACHE_FILE, PATCH_CACHE_FILE, STORE_DIR, STORE_INDEX_FILE, STORE_LINK_DIR
+    DOWNLOAD_DIR = os.path.abspath(download_dir)
+    FAILED_CHECKSUM_DIR = os.path.join(DOWNLOAD_DIR, "failed_checksum")
+    MANIFEST_CACHE_FILE = os.path.join(DOWNLOAD_DIR, "community_plugins.json")
+    HASH_INDEX_FILE = os.path.join(DOWNLOAD_DIR, "hash_index.json")
+    BUILD_LOG_DIR = os.path.join(DOWNLOAD_DIR, "logs")
+    GIT_CACHE_DIR = os.path.join(DOWNLOAD_DIR, "git-objects.git")
+    BUILD_CACHE_FILE = os.path.join(DOWNLOAD_DIR, "build_cache.json")
+    PATCH_CACHE_FILE = os.path.join(DOWNLOAD_DIR, "patch_cache.json")
+    STORE_DIR = os.path.join(DOWNLOAD_DIR, "store")
+    STORE_INDEX_FILE = os.path.join(DOWNLOAD_DIR, "store_index.json")
+    STORE_LINK_DIR = os.path.join(DOWNLOAD_DIR, "by-slug")
+
+
+set_download_dir(os.path.join(os.getcwd(), "downloads"))
+
+# Certain plugins require special branches, tags, or shas to be checked out to build successfully.
+PLUGIN_COMMITTISH_MAP = {
+    "Fundamental": "v0.5.1",
+    "mscHack": "master"
+}
+
+def check_git(out=None):
+    try:
+        subprocess.check_output(["git", "--version"])
+        return True
+    except Exception as e:
+        print("git is not available on this system: %s" % e, file=out)
+        return False
+
+
+def get_ssl_context():
+    global _ssl_context
+    with _connection_pool_lock:
+        if _ssl_context is None:
+            _ssl_context = ssl.create_default_context()
+        return _ssl_context
+
+
+def get_proxy(scheme, netloc):
+    # Use the proxy configured in the environment (http_proxy, https_proxy, no_proxy) or the system, like urllib does.
+    proxy = urllib.request.getproxies().get(scheme)
+    if not proxy or urllib.request.proxy_bypass(netloc):
+        return None
+    return proxy if "://" in proxy else "http://" + proxy
+
+
+def get_proxy_headers(proxy):
+    parts = urllib.parse.urlsplit(proxy)
+    if parts.username is None:
+        return {}
+    credentials = "%s:%s" % (urllib.parse.unquote(parts.username), urllib.parse.unquote(parts.password or ""))
+    return {"Proxy-Authorization": "Basic " + base64.b64encode(credentials.encode("utf-8")).decode("ascii")}
+
+
+def new_connection(scheme, netloc, proxy, timeout):
+    if proxy:
+        # HTTPS is tunneled through the proxy (CONNECT), plain HTTP requests are sent to the proxy (see open_url).
+        parts = urllib.parse.urlsplit(proxy)
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(parts.hostname, parts.port, timeout=timeout, context=get_ssl_context())
+            conn.set_tunnel(netloc, headers=get_proxy_headers(proxy))
+            return conn
+        if scheme == "http":
+            return http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    if scheme == "https":
+        return http.client.HTTPSConnection(netloc, timeout=timeout, context=get_ssl_context())
+    if scheme == "http":
+        return http.client.HTTPConnection(netloc, timeout=timeout)
+    raise urllib.error.URLError("Unsupported URL scheme: %s" % scheme)
+
+
+def get_connection(scheme, netloc, proxy, timeout):
+    # Connections are pooled per host and proxy.
+    with _connection_pool_lock:
+        idle = _connection_pool.get((scheme, netloc, proxy))
+        conn = idle.pop() if idle else None
+    if not conn:
+        return new_connection(scheme, netloc, proxy, timeout), False
+    conn.timeout = timeout
+    if conn.sock:
+        conn.sock.settimeout(timeout)
+    return conn, True
+
+
+def release_connection(scheme, netloc, proxy, conn, response):
+    # Only connections with a fully consumed response can be reused.
+    if not response.will_close and response.isclosed():
+        with _connection_pool_lock:
+            idle = _connection_pool.setdefault((scheme, netloc, proxy), [])
+            if len(idle) < HTTP_POOL_SIZE:
+                idle.append(conn)
+                return
+    conn.close()
+
+
+def close_connections():
+    with _connection_pool_lock:
+        for idle in _connection_pool.values():
+            for conn in idle:
+                conn.close()
+        _connection_pool.clear()
+
+
+def send_request(scheme, netloc, proxy, method, path, headers, timeout):
+    conn, reused = get_connection(scheme, netloc, proxy, timeout)
+    try:
+        conn.request(method, path, headers=headers)
+        response = conn.getresponse()
+    except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+        conn.close()
+        if not reused:
+            raise
+        # The server closed the idle keep-alive connection. Retry once on a fresh connection.
+        conn, reused = new_connection(scheme, netloc, proxy, timeout), False
+        try:
+            conn.request(method, path, headers=headers)
+            response = conn.getresponse()
+        except Exception:
+            conn.close()
+            raise
+    except Exception:
+        conn.close()
+        raise
+
+    with _connection_pool_lock:
+        connection_stats["reused" if reused else "opened"] += 1
+    return conn, response
+
+
+@contextlib.contextmanager
+def open_url(url, headers=None, method="GET", timeout=DOWNLOAD_TIMEOUT):
+    assert url
+    request_headers = {"User-Agent": USER_AGENT}
+    request_headers.update(headers or {})
+
+    for _ in range(HTTP_MAX_REDIRECTS + 1):
+        parts = urllib.parse.urlsplit(url)
+        path = (parts.path or "/") + ("?%s" % parts.query if parts.query else "")
+        proxy = get_proxy(parts.scheme, parts.netloc)
+        send_headers = request_headers
+        if proxy and parts.scheme == "http":
+            # Plain HTTP requests are sent to the proxy with the absolute URL.
+            path = "http://%s%s" % (parts.netloc, path)
+            send_headers = dict(request_headers, **get_proxy_headers(proxy))
+        conn, response = send_request(parts.scheme, parts.netloc, proxy, method, path, send_headers, timeout)
+
+        # Follow redirects (e.g. GitHub release downloads), draining the body so the connection can be reused.
+        location = response.getheader("Location")
+        if response.status in (301, 302, 303, 307, 308) and location:
+            response.read()
+            release_connection(parts.scheme, parts.netloc, proxy, conn, response)
+            url = urllib.parse.urljoin(url, location)
+            continue
+
+        if response.status >= 400:
+            response.read()
+            release_connection(parts.scheme, parts.netloc, proxy, conn, response)
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+
+        try:
+            yield response
+        except BaseException:
+            conn.close()
+            raise
+        release_connection(parts.scheme, parts.netloc, proxy, conn, response)
+        return
+
+    raise urllib.error.URLError("Too many redirects: %s" % url)
+
+
+class ChecksumError(Exception):
+    def __init__(self, expected, actual):
+        super().__init__("Checksum verification failed")
+        self.expected = expected
+        self.actual = actual
+
+
+def download_from_url(url, target_path, sha256=None, buffer_size=DOWNLOAD_BUFFER_SIZE,
+                      retries=DOWNLOAD_RETRIES, backoff=DOWNLOAD_RETRY_BACKOFF, timeout=DOWNLOAD_TIMEOUT, stats=None):
+    assert url
+    assert target_path
+
+    # The archive is downloaded into a temporary file, which is only renamed to its final name once
+    # it was verified, so target_path is never partially written. If the download fails, the temporary
+    # file is kept and the download is resumed from where it stopped (on the next attempt or run).
+    part_file = target_path + ".part"
+    attempt = 0
+    while True:
+        resumed = os.path.exists(part_file) and os.path.getsize(part_file) > 0
+        try:
+            actual = download_part(url, part_file, buffer_size, timeout, stats)
+        except urllib.error.HTTPError as e:
+            # Requested range not satisfiable. The temporary file does not match the archive (anymore).
+            if e.code == 416 and resumed:
+                os.remove(part_file)
+                continue
+            if attempt >= retries or (e.code < 500 and e.code != 429):
+                raise
+        except (OSError, http.client.HTTPException):
+            if attempt >= retries:
+                raise
+        else:
+            if not sha256 or sha256 == actual:
+                os.replace(part_file, target_path)
+                return actual
+            # A resumed download might have been continued from a stale temporary file. Start over once.
+            if resumed:
+                os.remove(part_file)
+                continue
+            os.makedirs(FAILED_CHECKSUM_DIR, exist_ok=True)
+            shutil.move(part_file, os.path.join(FAILED_CHECKSUM_DIR, os.path.basename(target_path)))
+            raise ChecksumError(sha256, actual)
+
+        # Exponential backoff with jitter before retrying.
+        time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+        attempt += 1
+
+
+def download_part(url, part_file, buffer_size=DOWNLOAD_BUFFER_SIZE, timeout=DOWNLOAD_TIMEOUT, stats=None):
+    # Hash the archive while it is downloaded. Existing data in part_file is hashed first
+    # and the download continues from there via an HTTP range request.
+    checksum = hashlib.sha256()
+    buffer = memoryview(bytearray(buffer_size))
+    offset = 0
+    if os.path.exists(part_file):
+        with open(part_file, "rb") as f:
+            for num_bytes in iter(lambda: f.readinto(buffer), 0):
+                checksum.update(buffer[:num_bytes])
+                offset += num_bytes
+
+    headers = {"Range": "bytes=%d-" % offset} if offset else None
+    with open_url(url, headers, timeout=timeout) as response:
+        # Server ignored the range request and sends the whole archive.
+        if offset and response.status != 206:
+            checksum = hashlib.sha256()
+            offset = 0
+        with open(part_file, "ab" if offset else "wb") as out_file:
+            while True:
+                num_bytes = response.readinto(buffer)
+                if not num_bytes:
+                    break
+                checksum.update(buffer[:num_bytes])
+                out_file.write(buffer[:num_bytes])
+                if stats is not None:
+                    stats["bytes"] += num_bytes
+        # A connection closed early may look like the end of the response. Let it count as a failed attempt.
+        if response.length:
+            raise http.client.IncompleteRead(b"", response.length)
+
+    return checksum.hexdigest()
+
+
+def hash_sha256(file_name, buffer_size=DOWNLOAD_BUFFER_SIZE):
+    hash_sha256 = hashlib.sha256()
+    buffer = memoryview(bytearray(buffer_size))
+    with open(file_name, "rb") as f:
+        for num_bytes in iter(lambda: f.readinto(buffer), 0):
+            hash_sha256.update(buffer[:num_bytes])
+    return hash_sha256.hexdigest()
+
+
+def load_hash_index():
+    try:
+        with open(HASH_INDEX_FILE, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_hash_index(hash_index):
+    # Drop entries for archives that no longer exist.
+    hash_index = {k: v for k, v in hash_index.items() if os.path.exists(os.path.join(DOWNLOAD_DIR, k))}
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    with open(HASH_INDEX_FILE + ".tmp", "w") as f:
+        json.dump(hash_index, f, indent=1, sort_keys=True)
+    os.replace(HASH_INDEX_FILE + ".tmp", HASH_INDEX_FILE)
+
+
+def get_stat_key(file_name):
+    st = os.stat(file_name)
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def record_sha256(file_name, checksum, hash_index):
+    hash_index[os.path.relpath(file_name, DOWNLOAD_DIR)] = {"stat": get_stat_key(file_name), "sha256": checksum}
+
+
+def cached_hash_sha256(file_name, hash_index, verify=False, buffer_size=DOWNLOAD_BUFFER_SIZE):
+    # Only re-hash the file if its size, mtime or inode changed since it was last hashed.
+    entry = hash_index.get(os.path.relpath(file_name, DOWNLOAD_DIR))
+    if not verify and entry and entry["stat"] == get_stat_key(file_name):
+        record_cache("hash_index", True)
+        return entry["sha256"]
+    record_cache("hash_index", False)
+    checksum = hash_sha256(file_name, buffer_size)
+    record_sha256(file_name, checksum, hash_index)
+    return checksum
+
+
+# Archives are stored by their SHA256 in STORE_DIR. The store index keeps track of the archives
+# ("archives": sha256 -> size, last use) and, per platform and plugin, of the archives of all known
+# versions and the one currently extracted to the plugins directory ("plugins": platform -> slug -> entry).
+def get_store_file(sha256):
+    return os.path.join(STORE_DIR, sha256[:2], sha256 + ".zip")
+
+
+def load_store_index():
+    try:
+        with open(STORE_INDEX_FILE, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {"archives": {}, "plugins": {}}
+
+
+def save_store_index(store_index):
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    with open(STORE_INDEX_FILE + ".tmp", "w") as f:
+        json.dump(store_index, f, indent=1, sort_keys=True)
+    os.replace(STORE_INDEX_FILE + ".tmp", STORE_INDEX_FILE)
+
+
+def get_archive_lock(sha256):
+    # Platforms may share an archive. Only one worker at a time verifies or downloads it.
+    with _store_lock:
+        return _archive_locks.setdefault(sha256, threading.Lock())
+
+
+def get_store_entry(store_index, platform, slug):
+    with _store_lock:
+        return store_index["plugins"].setdefault(platform, {}).setdefault(slug, {"current": None, "versions": {}})
+
+
+def get_current_archive(store_index, platform, slug):
+    entry = store_index["plugins"].get(platform, {}).get(slug)
+    return entry["current"] if entry else None
+
+
+def get_version_link(platform, slug, version):
+    return os.path.join(STORE_LINK_DIR, platform, slug, re.sub(r"[^\w.+-]", "_", version) + ".zip")
+
+
+def link_version(platform, slug, version, sha256):
+    # Convenience link downloads/by-slug/<platform>/<slug>/<version>.zip to the archive in the store.
+    # Not all platforms (or users) are allowed to create symbolic links. The store works without them.
+    link = get_version_link(platform, slug, version)
+    try:
+        os.makedirs(os.path.dirname(link), exist_ok=True)
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.relpath(get_store_file(sha256), os.path.dirname(link)), link)
+    except (OSError, NotImplementedError):
+        pass
+
+
+def add_to_store(store_index, platform, slug, version, sha256):
+    entry = get_store_entry(store_index, platform, slug)
+    with _store_lock:
+        archive = store_index["archives"].setdefault(sha256, {})
+        archive["size"] = os.path.getsize(get_store_file(sha256))
+        archive["last_used"] = time.time()
+        # Versions are keyed by checksum, a version might have been re-released with a different archive.
+        entry["versions"].setdefault(sha256, {"installed": None})["version"] = version
+    link_version(platform, slug, version, sha256)
+
+
+def get_archive_root(store_index, sha256):
+    # The root folder of an archive in the store never changes. Only open the archive once to look it up.
+    archive = store_index["archives"].get(sha256)
+    if archive and archive.get("root"):
+        record_cache("plugin_root", True)
+        return archive["root"]
+    record_cache("plugin_root", False)
+    plugin_root = get_plugin_root(get_store_file(sha256))
+    if archive is not None:
+        with _store_lock:
+            archive["root"] = plugin_root
+    return plugin_root
+
+
+def set_current_archive(store_index, platform, slug, sha256):
+    entry = get_store_entry(store_index, platform, slug)
+    with _store_lock:
+        entry["current"] = sha256
+        if sha256 in entry["versions"]:
+            entry["versions"][sha256]["installed"] = time.time()
+
+
+def adopt_legacy_archive(plugin, platform, hash_index, verify=False, dry_run=False, buffer_size=DOWNLOAD_BUFFER_SIZE):
+    # Archives downloaded before the store existed are named after the download URL.
+    # Move an archive into the store if it matches the manifest's checksum (instead of downloading it again).
+    download = plugin["downloads"][platform]
+    legacy_file = os.path.join(DOWNLOAD_DIR, os.path.basename(download["download"]).split('?')[0])
+    if not os.path.isfile(legacy_file) or download["sha256"] != cached_hash_sha256(legacy_file, hash_index, verify, buffer_size):
+        return False
+    if not dry_run:
+        store_file = get_store_file(download["sha256"])
+        os.makedirs(os.path.dirname(store_file), exist_ok=True)
+        os.replace(legacy_file, store_file)
+        record_sha256(store_file, download["sha256"], hash_index)
+    return True
+
+
+def collect_garbage(store_index, max_size=None, max_age=None):
+    # Evict archives that are not extracted to the plugins directory (for any platform): all of them if no
+    # limit is given, otherwise archives not used for max_age days and then the least recently used ones
+    # until the store is no larger than max_size bytes. Returns the number and size of the evicted archives.
+    now = time.time()
+    archives = store_index["archives"]
+
+    # Drop archives that went missing and pick up archives and stale downloads not in the index.
+    for sha256 in [s for s in archives if not os.path.exists(get_store_file(s))]:
+        del archives[sha256]
+    files = {}
+    for file_name in glob.glob(os.path.join(STORE_DIR, "*", "*")):
+        name = os.path.basename(file_name)
+        if name.endswith(".zip") and name[:-len(".zip")] in archives:
+            continue
+        st = os.stat(file_name)
+        files[file_name] = {"size": st.st_size, "last_used": st.st_mtime}
+
+    current = set(e["current"] for entries in store_index["plugins"].values() for e in entries.values() if e["current"])
+    candidates = dict(files)
+    candidates.update((get_store_file(s), a) for s, a in archives.items() if s not in current)
+    candidates = sorted(candidates.items(), key=lambda c: c[1]["last_used"])
+
+    total_size = sum(a["size"] for a in archives.values()) + sum(f["size"] for f in files.values())
+    evict = []
+    for file_name, info in candidates:
+        if (max_size is None and max_age is None) \
+                or (max_age is not None and now - info["last_used"] > max_age * 86400) \
+                or (max_size is not None and total_size > max_size):
+            evict.append(file_name)
+            total_size -= info["size"]
+
+    evicted_size = 0
+    for file_name in evict:
+        evicted_size += os.path.getsize(file_name)
+        os.remove(file_name)
+        name = os.path.basename(file_name)
+        if name.endswith(".zip"):
+            archives.pop(name[:-len(".zip")], None)
+
+    # Forget versions whose archive was evicted.
+    for platform, entries in store_index["plugins"].items():
+        for slug, entry in entries.items():
+            for sha256 in [s for s in entry["versions"] if s not in archives]:
+                link = get_version_link(platform, slug, entry["versions"].pop(sha256)["version"])
+                if os.path.lexists(link) and not os.path.exists(link):
+                    os.remove(link)
+
+    return len(evict), evicted_size
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("platform", nargs='+', help="platform(s) to download plugins for. With several platforms, each is synced to a subdirectory of the same name", type=str, choices=["win", "mac", "lin"])
+    parser.add_argument("-i", "--include", nargs='+', help="list of plugins to include in download (white-space separated)")
+    parser.add_argument("-x", "--exclude", nargs='+', help="list of plugins to exclude from download (white-space separated)")
+    parser.add_argument("-s", "--source", action='store_true', help="attempt to build plugins from source if binary release is not available", default=False)
+    parser.add_argument("-j", "--jobs", type=int, help="number of jobs to pass to make command via -j option", default=1)
+    parser.add_argument("-c", "--clean", action='store_true', help="clean plugin build via 'make clean'", default=False)
+    parser.add_argument("-d", "--delete", action='store_true', help="delete plugins from plugins directory. Use with caution!", default=False)
+    parser.add_argument("-y", "--yes", action='store_true', help="assume 'yes' as the answer to any question asked by the script", default=False)
+    parser.add_argument("-l", "--list", action='store_true', help="list all available plugins", default=False)
+    parser.add_argument("-p", "--patch", nargs='+', help="list of patch files (or directories containing patch files) to download plugins for (white-space separated)")
+    parser.add_argument("--prefer-source", action='store_true', help="prefer building plugin source over downloading binaries even if binaries are available", default=False)
+    parser.add_argument("-u", "--update", action='store_true', help="update all existing plugins found in the plugins directory", default=False)
+    parser.add_argument("--git-cache", nargs='?', const=GIT_CACHE_DIR, help="share git objects of all plugin sources and submodules via a reference repository (default: %s)" % os.path.relpath(GIT_CACHE_DIR), default=None)
+    parser.add_argument("--clone-mode", type=str, choices=["full", "blobless", "shallow"], help="how to clone plugin sources: full history, blobless (partial clone) or shallow (pinned revision only)", default="full")
+    parser.add_argument("--parallel-builds", type=int, help="number of plugins to build from source concurrently, sharing the jobs given by -j", default=1)
+    parser.add_argument("--parallel-downloads", type=int, help="number of plugins to download, verify and extract concurrently", default=1)
+    parser.add_argument("--pool-size", type=int, help="number of idle keep-alive HTTP connections to keep per host", default=HTTP_POOL_SIZE)
+    parser.add_argument("--manifest-ttl", type=int, help="number of seconds the cached plugin manifest is used without revalidation", default=MANIFEST_TTL)
+    parser.add_argument("--buffer-size", type=int, help="size of the download and hashing buffer in KiB", default=DOWNLOAD_BUFFER_SIZE // 1024)
+    parser.add_argument("--retries", type=int, help="number of times a failed download is retried (resuming where it stopped)", default=DOWNLOAD_RETRIES)
+    parser.add_argument("--retry-backoff", type=float, help="initial delay in seconds before retrying a failed download, doubled on each retry", default=DOWNLOAD_RETRY_BACKOFF)
+    parser.add_argument("--timeout", type=float, help="network timeout in seconds for connecting to and reading from a server", default=DOWNLOAD_TIMEOUT)
+    parser.add_argument("--incremental", action='store_true', help="only write files that changed when updating an extracted plugin", default=False)
+    parser.add_argument("--verify-all", action='store_true', help="re-hash all downloaded archives instead of trusting the hash index", default=False)
+    parser.add_argument("--plan", type=str, help="write the planned actions as JSON to the given file ('-' for stdout) without downloading, extracting, building or deleting anything")
+    parser.add_argument("--report", type=str, help="write timings, transferred bytes and cache statistics of the run as JSON to the given file")
+    parser.add_argument("--profile", type=str, help="profile the run with cProfile and write the statistics to the given file")
+    parser.add_argument("--offline", action='store_true', help="use the cached plugin manifest and downloaded archives only (no network access)", default=False)
+    parser.add_argument("--rollback", nargs='?', const="", metavar="VERSION", help="extract the previously installed (or the given) version of the selected plugins from the archive store")
+    parser.add_argument("--gc", action='store_true', help="evict archives that are not installed from the archive store (see --max-store-size, --max-store-age) and exit", default=False)
+    parser.add_argument("--max-store-size", type=int, metavar="MIB", help="with --gc, only evict (least recently used) archives until the archive store is no larger than this")
+    parser.add_argument("--serve", type=str, metavar="[HOST:]PORT", help="serve the plugin manifest and verified archives from the archive store to other machines (a mirror), fetching archives from upstream on demand")
+    parser.add_argument("--mirror", type=str, metavar="URL", help="get the plugin manifest and archives from a mirror (see --serve) instead of the VCV Rack servers")
+    parser.add_argument("--max-store-age", type=float, metavar="DAYS", help="with --gc, only evict archives not used for this many days (and those exceeding --max-store-size)")
+
+    return parser.parse_args(argv)
+
+
+def get_source_dir(plugin_name):
+    return os.path.join(os.getcwd(), plugin_name.replace(" ", "_")+".git")
+
+
+def get_build_log_file(plugin_name):
+    return os.path.join(BUILD_LOG_DIR, plugin_name.replace(" ", "_")+".log")
+
+
+def run_command(command, cwd, log=None, **kwargs):
+    # Command output goes to the console, unless a (per-plugin) log file is given.
+    subprocess.check_call(command, cwd=cwd, stdout=log, stderr=subprocess.STDOUT if log else None, **kwargs)
+
+
+def update_git_cache(git_cache, git_repo_url, out=None, log=None):
+    # Fetch all branches and tags of a repository into its own namespace of the shared object store.
+    # Each repository (including submodules shared by several plugins) is only fetched once per run.
+    # Different repositories are fetched concurrently, each into its own namespace.
+    key = (git_cache, git_repo_url)
+    with _git_cache_lock:
+        lock = _git_cache_locks.setdefault(key, threading.Lock())
+    with lock:
+        if key in _git_cache_fetched:
+            return
+        try:
+            with _git_cache_lock:
+                if not os.path.exists(git_cache):
+                    run_command(["git", "init", "--quiet", "--bare", git_cache], os.getcwd(), log)
+            namespace = "refs/cache/%s" % hashlib.sha1(git_repo_url.encode("utf-8")).hexdigest()
+            run_command(["git", "fetch", "--quiet", "--no-tags", git_repo_url,
+                         "+refs/heads/*:%s/heads/*" % namespace, "+refs/tags/*:%s/tags/*" % namespace], git_cache, log)
+        except Exception as e:
+            print("ERROR: Failed to update git object cache for '%s': %s" % (git_repo_url, e), file=out)
+            raise e
+        _git_cache_fetched.add(key)
+
+
+def get_clone_options(clone_mode, committish=None):
+    # A shallow clone requires a pinned branch or tag (git clone --branch does not take a sha). Otherwise the history
+    # is needed to find the latest tag or the pinned sha, so fall back to a blobless clone (file contents are fetched on checkout only).
+    if clone_mode == "shallow" and committish and not re.fullmatch(r"[0-9a-fA-F]{7,40}", committish):
+        return ["--depth", "1", "--branch", committish]
+    if clone_mode in ["shallow", "blobless"]:
+        return ["--filter=blob:none"]
+    return []
+
+
+def clone_source(plugin_name, git_repo_url, out=None, log=None, git_cache=None, clone_mode="full", committish=None):
+    try:
+        command = ["git", "clone"] + get_clone_options(clone_mode, committish)
+        if git_cache:
+            update_git_cache(git_cache, git_repo_url, out, log)
+            command += ["--reference", git_cache]
+        run_command(command + [git_repo_url, os.path.basename(get_source_dir(plugin_name))], os.getcwd(), log)
+    except Exception as e:
+        print("[%s] ERROR: Failed to clone source: %s" % (plugin_name, e), file=out)
+        raise e
+
+def get_submodule_urls(plugin_name):
+    try:
+        output = subprocess.check_output(["git", "config", "--file", ".gitmodules", "--get-regexp", r"^submodule\..*\.url$"], cwd=get_source_dir(plugin_name))
+    except subprocess.CalledProcessError:
+        return []
+    return [line.split(None, 1)[1] for line in output.decode("UTF-8").splitlines() if " " in line]
+
+def update_submodules(plugin_name, out=None, log=None, git_cache=None, clone_mode="full"):
+    try:
+        command = ["git", "submodule", "update", "--init", "--recursive"]
+        # Submodules are always pinned to a commit, which a shallow clone might not contain. Use a blobless clone instead.
+        if clone_mode in ["shallow", "blobless"]:
+            command += ["--filter=blob:none"]
+        if git_cache:
+            # Relative submodule URLs resolve against the plugin repository, which is in the cache already.
+            for url in get_submodule_urls(plugin_name):
+                if not url.startswith("."):
+                    update_git_cache(git_cache, url, out, log)
+            command += ["--reference", git_cache]
+        run_command(command, get_source_dir(plugin_name), log)
+    except Exception as e:
+        print("[%s] ERROR: Failed to update submodule: %s" % (plugin_name, e), file=out)
+        raise e
+
+
+def check_out_revision(plugin_name, committish, out=None, log=None):
+    try:
+        run_command(["git", "checkout", committish], get_source_dir(plugin_name), log)
+    except Exception as e:
+        print("[%s] ERROR: Failed to check out revision: %s" % (plugin_name, e), file=out)
+        raise e
+
+
+def update_source(plugin_name, git_repo_url, fetch_only=False, out=None, log=None):
+    try:
+        run_command(["git", "fetch", "--all"], get_source_dir(plugin_name), log)
+        if not fetch_only:
+            run_command(["git", "merge", "origin/master"], get_source_dir(plugin_name), log)
+    except Exception as e:
+        print("[%s] ERROR: Failed to update source: %s" % (plugin_name, e), file=out)
+        raise e
+
+
+def create_jobserver(num_jobs):
+    # GNU make jobserver shared by all concurrent builds: a pipe holding one token per job.
+    # A token is taken for every make invocation (its implicit job slot), additional jobs
+    # are requested from the pipe by make itself.
+    if os.name != "posix":
+        return None
+    jobserver = os.pipe()
+    os.write(jobserver[1], b"+" * max(1, num_jobs))
+    return jobserver
+
+
+def close_jobserver(jobserver):
+    if jobserver:
+        os.close(jobserver[0])
+        os.close(jobserver[1])
+
+
+def build_source(plugin_name, num_jobs=4, out=None, log=None, jobserver=None):
+    try:
+        if jobserver:
+            read_fd, write_fd = jobserver
+            token = os.read(read_fd, 1)
+            try:
+                env = dict(os.environ, MAKEFLAGS="-j%s --jobserver-fds=%d,%d --jobserver-auth=%d,%d" % (num_jobs, read_fd, write_fd, read_fd, write_fd))
+                run_command(["make"], get_source_dir(plugin_name), log, env=env, pass_fds=jobserver)
+            finally:
+                os.write(write_fd, token)
+        else:
+            run_command(["make", "-j%s" % num_jobs], get_source_dir(plugin_name), log)
+    except Exception as e:
+        print("[%s] ERROR: Failed to build from source: %s" % (plugin_name, e), file=out)
+        raise e
+
+
+def get_latest_git_tag(plugin_name, out=None, log=None):
+    try:
+        output = subprocess.check_output(["git", "describe", "--abbrev=0", "--tags"], cwd=get_source_dir(plugin_name), stderr=log)
+        return output.strip().decode("UTF-8")
+    except Exception:
+        print("[%s] WARNING: Could not determine git tag" % plugin_name, file=out)
+        return None
+
+
+def get_revision(plugin_name, committish, log=None):
+    output = subprocess.check_output(["git", "rev-parse", "%s^{commit}" % committish], cwd=get_source_dir(plugin_name), stderr=log)
+    return output.strip().decode("UTF-8")
+
+
+def get_submodule_revisions(plugin_name, revision, log=None):
+    # Submodule commits recorded in the given revision (without checking it out).
+    output = subprocess.check_output(["git", "ls-tree", "-r", revision], cwd=get_source_dir(plugin_name), stderr=log)
+    submodules = {}
+    for line in output.decode("UTF-8").splitlines():
+        info, path = line.split("\t", 1)
+        mode, object_type, sha = info.split()
+        if object_type == "commit":
+            submodules[path] = sha
+    return submodules
+
+
+def get_command_version(command):
+    try:
+        output = subprocess.check_output(command + ["--version"], stderr=subprocess.DEVNULL)
+        return output.decode("UTF-8", "replace").strip().splitlines()[0]
+    except Exception:
+        return None
+
+
+def get_toolchain_fingerprint():
+    # Everything outside of the plugin source that affects the build result.
+    global _toolchain_fingerprint
+    if _toolchain_fingerprint is None:
+        rack_revision = None
+        try:
+            rack_revision = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.getcwd()), stderr=subprocess.DEVNULL).strip().decode("UTF-8")
+        except Exception:
+            pass
+        _toolchain_fingerprint = {
+            "platform": sysconfig.get_platform(),
+            "make": get_command_version(["make"]),
+            "cc": get_command_version([os.environ.get("CC", "cc")]),
+            "cxx": get_command_version([os.environ.get("CXX", "c++")]),
+            "env": {k: os.environ[k] for k in ["CC", "CXX", "CFLAGS", "CXXFLAGS", "LDFLAGS", "RACK_DIR"] if k in os.environ},
+            "rack": rack_revision
+        }
+    return _toolchain_fingerprint
+
+
+def get_build_key(plugin_name, committish, log=None):
+    revision = get_revision(plugin_name, committish, log)
+    key = {
+        "revision": revision,
+        "submodules": get_submodule_revisions(plugin_name, revision, log),
+        "toolchain": get_toolchain_fingerprint()
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest(), revision
+
+
+def has_build_output(plugin_name):
+    # The plugin library built by the Rack SDK. plugin.json (and other plugin.* files) may be part of the sources.
+    return any(os.path.isfile(os.path.join(get_source_dir(plugin_name), "plugin." + ext)) for ext in ["so", "dll", "dylib"])
+
+
+def load_build_cache():
+    try:
+        with open(BUILD_CACHE_FILE, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_build_cache(build_cache):
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    with open(BUILD_CACHE_FILE + ".tmp", "w") as f:
+        json.dump(build_cache, f, indent=1, sort_keys=True)
+    os.replace(BUILD_CACHE_FILE + ".tmp", BUILD_CACHE_FILE)
+
+
+def clean_build(plugin_name, out=None, log=None):
+    try:
+        run_command(["make", "clean"], get_source_dir(plugin_name), log)
+    except Exception as e:
+        print("[%s] ERROR: Failed to clean build: %s" % (plugin_name, e), file=out)
+        raise e
+
+
+def api_request(url, payload=None):
+    assert url
+    req = "%s%s" % (url, "" if not payload else "?%s" % urllib.parse.urlencode(payload))
+    with open_url(req) as response:
+        return response.read().decode('utf-8')
+
+
+def load_manifest_cache():
+    # Keep the parsed manifest in memory until the cache file changes (e.g. for several syncs in one process).
+    global _manifest_memo
+    try:
+        stat_key = [MANIFEST_CACHE_FILE] + get_stat_key(MANIFEST_CACHE_FILE)
+        if _manifest_memo and _manifest_memo[0] == stat_key:
+            return _manifest_memo[1]
+        with open(MANIFEST_CACHE_FILE, "r") as f:
+            cache = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    _manifest_memo = (stat_key, cache)
+    return cache
+
+
+def save_manifest_cache(cache):
+    global _manifest_memo
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    with open(MANIFEST_CACHE_FILE + ".tmp", "w") as f:
+        json.dump(cache, f)
+    os.replace(MANIFEST_CACHE_FILE + ".tmp", MANIFEST_CACHE_FILE)
+    _manifest_memo = ([MANIFEST_CACHE_FILE] + get_stat_key(MANIFEST_CACHE_FILE), cache)
+
+
+def get_manifest_cache(api_host=None):
+    # The cached manifest is only used for the host it was fetched from. The downloads of a mirror's manifest point to the mirror.
+    cache = load_manifest_cache()
+    return cache if cache and cache.get("api_host") == (api_host or RACK_API_HOST) else None
+
+
+def get_community_plugins(offline=False, ttl=MANIFEST_TTL, out=None, api_host=None):
+    api_host = api_host or RACK_API_HOST
+    cache = get_manifest_cache(api_host)
+
+    if offline:
+        if not cache:
+            raise RuntimeError("No cached plugin manifest of %s available for offline mode" % api_host)
+        record_cache("manifest", True)
+        return cache["manifest"]
+
+    # Cached manifest is recent enough. Skip the request entirely.
+    if cache and time.time() - cache["timestamp"] < ttl:
+        record_cache("manifest", True)
+        return cache["manifest"]
+
+    # Revalidate the cached manifest with a conditional request.
+    headers = {}
+    if cache and cache["etag"]:
+        headers["If-None-Match"] = cache["etag"]
+    if cache and cache["last_modified"]:
+        headers["If-Modified-Since"] = cache["last_modified"]
+
+    try:
+        with open_url(api_host+"/community/plugins", headers) as response:
+            body = response.read()
+            if response.status == 304 and cache:
+                record_cache("manifest", True)
+                cache["timestamp"] = time.time()
+                save_manifest_cache(cache)
+                return cache["manifest"]
+            cache = {
+                "api_host": api_host,
+                "etag": response.getheader("ETag"),
+                "last_modified": response.getheader("Last-Modified"),
+                "timestamp": time.time(),
+                "manifest": json.loads(body.decode('utf-8'))
+            }
+    except (OSError, http.client.HTTPException) as e:
+        if not cache:
+            raise e
+        print("WARNING: Failed to update plugin manifest, using cached version: %s" % e, file=out)
+        record_cache("manifest", True)
+        return cache["manifest"]
+
+    record_cache("manifest", False)
+    save_manifest_cache(cache)
+    return cache["manifest"]
+
+
+def build_plugin_index(community_plugins):
+    # Slug-keyed index of the manifest, plus a lookup of lower-case slugs for case-insensitive matching.
+    plugin_index = {p["slug"]: p for p in community_plugins}
+    slug_lookup = {slug.lower(): slug for slug in plugin_index}
+    return plugin_index, slug_lookup
+
+
+def match_plugins(pattern, plugin_index, slug_lookup):
+    # A pattern is either a slug (matched case-insensitively if there is no exact match),
+    # a glob pattern (e.g. "Audible*") or a regular expression prefixed with "re:" (e.g. "re:^(Befaco|Bogaudio)$").
+    if pattern in plugin_index:
+        return [pattern]
+    if pattern.lower() in slug_lookup:
+        return [slug_lookup[pattern.lower()]]
+    if pattern.startswith("re:"):
+        regex = re.compile(pattern[3:], re.IGNORECASE)
+        return [slug for slug in plugin_index if regex.search(slug)]
+    if any(c in pattern for c in "*?["):
+        regex = re.compile(fnmatch.translate(pattern), re.IGNORECASE)
+        return [slug for slug in plugin_index if regex.match(slug)]
+    return []
+
+
+def get_plugins_from_patch_file(patch_file, out=None):
+    # Returns None if the patch file is invalid.
+    plugins = set()
+    try:
+        # Only extract the plugin names from the patch, without loading the whole patch into memory (if ijson is available).
+        if ijson:
+            with open(patch_file, 'rb') as pf:
+                plugins = set(ijson.items(pf, "modules.item.plugin"))
+            if not plugins:
+                print("ERROR: No plugins found in patch file '%s" % patch_file, file=out)
+        else:
+            with open(patch_file, 'r') as pf:
+                patch_json = json.load(pf)
+            plugins = set([x["plugin"] for x in patch_json["modules"]])
+    except KeyError:
+        print("ERROR: No plugins found in patch file '%s" % patch_file, file=out)
+        # Empty patch
+    except (ValueError, getattr(ijson, "JSONError", ValueError)) as e:
+        print("ERROR: Invalid patch file '%s': %s" % (patch_file, e), file=out)
+        return None
+    return sorted(plugins)
+
+
+def find_patch_files(patch_paths, out=None):
+    # Returns None if any of the paths is not a patch file or directory.
+    patch_files = []
+    for path in patch_paths:
+        if os.path.isdir(path):
+            patch_files += sorted(glob.glob(os.path.join(path, "**", "*.vcv"), recursive=True))
+        elif os.path.isfile(path) and path.endswith(".vcv"):
+            patch_files.append(path)
+        else:
+            print("ERROR: Invalid patch file: '%s'. Aborting." % path, file=out)
+            return None
+    return patch_files
+
+
+def load_patch_cache():
+    try:
+        with open(PATCH_CACHE_FILE, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_patch_cache(patch_cache):
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    with open(PATCH_CACHE_FILE + ".tmp", "w") as f:
+        json.dump(patch_cache, f, indent=1, sort_keys=True)
+    os.replace(PATCH_CACHE_FILE + ".tmp", PATCH_CACHE_FILE)
+
+
+def get_plugins_from_patch_files(patch_files, patch_cache, out=None):
+    # Plugins per patch file. Patch files that did not change since they were last parsed
+    # are taken from the cache, all others are parsed concurrently.
+    results = {}
+    stat_keys = {}
+    for patch_file in patch_files:
+        st = os.stat(patch_file)
+        stat_keys[patch_file] = [st.st_size, st.st_mtime_ns]
+        entry = patch_cache.get(os.path.abspath(patch_file))
+        if entry and entry["stat"] == stat_keys[patch_file]:
+            results[patch_file] = entry["plugins"]
+        record_cache("patch", patch_file in results)
+
+    parse_files = [pf for pf in patch_files if pf not in results]
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        for patch_file, plugins in zip(parse_files, executor.map(lambda pf: get_plugins_from_patch_file(pf, out), parse_files)):
+            results[patch_file] = plugins or []
+            if plugins is not None:
+                patch_cache[os.path.abspath(patch_file)] = {"stat": stat_keys[patch_file], "plugins": plugins}
+
+    return {pf: results[pf] for pf in patch_files}
+
+
+def get_plugin_root(zip_file):
+    with zipfile.ZipFile(zip_file) as z:
+        return z.namelist()[0].replace("\\", "/").strip("/").split("/")[0]
+
+
+def create_shared_dirs(z, plugin_root, plugins_dir):
+    # Archives extracted concurrently may share folders outside of their plugin root folder (e.g. "__MACOSX").
+    # zipfile creates missing folders with a check-then-create, which fails if another archive creates it in between.
+    dirs = set()
+    for info in z.infolist():
+        parts = [x for x in info.filename.replace("\\", "/").split("/") if x not in ("", ".", "..")]
+        if parts and parts[0] != plugin_root:
+            dirs.add(os.path.join(plugins_dir, *(parts if info.is_dir() else parts[:-1])))
+    with _extract_lock:
+        for d in sorted(dirs):
+            os.makedirs(d, exist_ok=True)
+
+
+def file_crc32(file_name, buffer_size=DOWNLOAD_BUFFER_SIZE):
+    crc = 0
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(buffer_size), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def extract_incremental(zip_file, plugin_root, plugins_dir, buffer_size=DOWNLOAD_BUFFER_SIZE):
+    # Assemble the new version of the plugin in a staging directory next to the current one.
+    # Files that did not change (same size and CRC32) are hard-linked from the current version,
+    # only changed files are written. Files that are not part of the archive anymore are dropped.
+    # The staging directory is then swapped in for the current version.
+    plugin_path = os.path.join(plugins_dir, plugin_root)
+    staging_path = os.path.join(plugins_dir, ".%s.staging" % plugin_root)
+    old_path = os.path.join(plugins_dir, ".%s.old" % plugin_root)
+
+    # Recover from an update that was interrupted while swapping directories.
+    if os.path.exists(old_path):
+        if os.path.exists(plugin_path):
+            shutil.rmtree(old_path)
+        else:
+            os.rename(old_path, plugin_path)
+    if os.path.exists(staging_path):
+        shutil.rmtree(staging_path)
+
+    written = 0
+    unchanged = 0
+    try:
+        os.mkdir(staging_path)
+        with zipfile.ZipFile(zip_file) as z:
+            create_shared_dirs(z, plugin_root, plugins_dir)
+            for info in z.infolist():
+                parts = [x for x in info.filename.replace("\\", "/").split("/") if x not in ("", ".")]
+                if not parts or ".." in parts or os.path.isabs(info.filename):
+                    continue
+
+                # Extract anything outside of the plugin root folder (e.g. "__MACOSX") as usual.
+                if parts[0] != plugin_root:
+                    z.extract(info, plugins_dir)
+                    continue
+
+                staged_file = os.path.join(staging_path, *parts[1:])
+                if info.is_dir():
+                    os.makedirs(staged_file, exist_ok=True)
+                    continue
+                os.makedirs(os.path.dirname(staged_file), exist_ok=True)
+
+                current_file = os.path.join(plugin_path, *parts[1:])
+                if os.path.isfile(current_file) and not os.path.islink(current_file) \
+                        and os.path.getsize(current_file) == info.file_size \
+                        and file_crc32(current_file, buffer_size) == info.CRC:
+                    try:
+                        os.link(current_file, staged_file)
+                    except OSError:
+                        shutil.copy2(current_file, staged_file)
+                    unchanged += 1
+                else:
+                    with z.open(info) as src, open(staged_file, "wb") as dst:
+                        shutil.copyfileobj(src, dst, buffer_size)
+                    written += 1
+    except BaseException:
+        shutil.rmtree(staging_path, ignore_errors=True)
+        raise
+
+    if os.path.exists(plugin_path):
+        os.rename(plugin_path, old_path)
+    os.rename(staging_path, plugin_path)
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+
+    return written, unchanged
+
+
+def get_installed_plugin_dir(plugin, platform, installed_dirs, store_index):
+    # installed_dirs is the set of entries in the plugins directory.
+    slug = plugin['slug']
+
+    # TODO Remove this when all plugins are adhering to plugin conventions.
+    # Some plugins have directory names that do not match the slug.
+    # Look at the archive that is extracted, the current archive of the manifest or a legacy download.
+    candidates = [slug, slug+".git"]
+    checksums = [get_current_archive(store_index, platform, slug)]
+    if "downloads" in plugin and platform in plugin["downloads"].keys():
+        checksums.append(plugin["downloads"][platform].get("sha256"))
+    for sha256 in checksums:
+        if sha256 and os.path.exists(get_store_file(sha256)):
+            candidates.insert(0, get_archive_root(store_index, sha256))
+            break
+    else:
+        if "downloads" in plugin and platform in plugin["downloads"].keys():
+            file_name = os.path.basename(plugin["downloads"][platform]["download"]).split('?')[0]
+            try:
+                candidates.insert(0, get_plugin_root(os.path.join(DOWNLOAD_DIR, file_name)))
+            except (FileNotFoundError, zipfile.BadZipFile):
+                pass
+
+    plugin_dirs = [d for d in candidates if d in installed_dirs]
+    return plugin_dirs[0] if plugin_dirs else None
+
+
+def move_to_trash(path, trash_dir):
+    # Renaming is instant (the trash directory is on the same file system), the actual removal happens later.
+    os.makedirs(trash_dir, exist_ok=True)
+    trash_path = os.path.join(trash_dir, "%s.%d" % (os.path.basename(path), time.time_ns()))
+    os.rename(path, trash_path)
+    return trash_path
+
+
+def empty_trash(trash_dir):
+    # Remove the trash directory (and any left over by an interrupted removal) in a detached process,
+    # which keeps running after the script returns. The next plugin deleted goes to a new trash directory.
+    paths = glob.glob(glob.escape(trash_dir) + ".*")
+    if os.path.isdir(trash_dir):
+        paths.append("%s.%d" % (trash_dir, time.time_ns()))
+        os.rename(trash_dir, paths[-1])
+    if not paths:
+        return
+    if os.name == "nt":
+        kwargs = {"creationflags": subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        kwargs = {"start_new_session": True}
+    subprocess.Popen([sys.executable, "-c", "import shutil, sys\nfor p in sys.argv[1:]: shutil.rmtree(p, ignore_errors=True)"] + paths,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **kwargs)
+
+
+def get_download_size(url, timeout=DOWNLOAD_TIMEOUT):
+    try:
+        with open_url(url, method="HEAD", timeout=timeout) as response:
+            response.read()
+            length = response.getheader("Content-Length")
+            return int(length) if length else None
+    except (OSError, http.client.HTTPException, ValueError):
+        return None
+
+
+def plan_binary(plugin, platform, plugins_dir, options, hash_index, store_index):
+    # Mirrors the decisions of process_binary() without downloading or extracting anything.
+    # Returns the planned actions and whether the binary release covers the plugin.
+    slug = plugin['slug']
+
+    if "downloads" not in plugin:
+        return [{"action": "none", "reason": "no binary archive downloads available"}], False
+    if platform not in plugin["downloads"].keys():
+        return [{"action": "none", "reason": "no binary archive for platform %s" % PLATFORM_STRING[platform]}], False
+
+    url = plugin["downloads"][platform]["download"]
+    sha256 = plugin["downloads"][platform]["sha256"] if "sha256" in plugin["downloads"][platform].keys() else None
+    if not sha256:
+        return [{"action": "error", "reason": "missing SHA256 checksum"}], False
+    store_file = get_store_file(sha256)
+
+    actions = []
+    if os.path.exists(store_file):
+        download = sha256 != cached_hash_sha256(store_file, hash_index, options.verify_all, options.buffer_size * 1024)
+    else:
+        download = not adopt_legacy_archive(plugin, platform, hash_index, options.verify_all, dry_run=True, buffer_size=options.buffer_size * 1024)
+    if download:
+        if options.offline:
+            return [{"action": "error", "reason": "download not possible in offline mode"}], False
+        actions.append({"action": "download", "url": url, "file": store_file, "bytes": None})
+        plugin_root = slug
+    elif os.path.exists(store_file):
+        plugin_root = get_archive_root(store_index, sha256)
+    else:
+        plugin_root = get_plugin_root(os.path.join(DOWNLOAD_DIR, os.path.basename(url).split('?')[0]))
+
+    plugin_path = os.path.join(plugins_dir, plugin_root)
+    current = get_current_archive(store_index, platform, slug)
+    if download or not os.path.exists(plugin_path) or (current and current != sha256):
+        actions.append({"action": "extract", "path": plugin_path, "replace": os.path.exists(plugin_path)})
+    if not actions:
+        actions.append({"action": "none", "reason": "already at newest version"})
+    return actions, True
+
+
+def plan_source(plugin, options, build_cache):
+    slug = plugin['slug']
+    if "source" not in plugin.keys():
+        return [{"action": "error", "reason": "no source URL specified"}]
+
+    # Whether a cached build is reused can only be decided after fetching the source.
+    # Estimate a rebuild for plugins without a cached build.
+    cached = not options.clean and slug in build_cache and has_build_output(slug)
+    return [{"action": "build", "source": plugin["source"], "clone": not os.path.exists(get_source_dir(slug)), "estimated_rebuild": not cached}]
+
+
+def create_plan(plugins, platform, plugins_dir, options, hash_index, store_index, build_cache):
+    plan = {"version": __version__, "platform": platform, "plugins_dir": plugins_dir, "plugins": []}
+    installed_dirs = set(os.listdir(plugins_dir) if os.path.isdir(plugins_dir) else []) if options.delete else None
+
+    for plugin in plugins:
+        slug = plugin['slug']
+        entry = {"slug": slug, "version": plugin['version'] if "version" in plugin.keys() else None, "actions": []}
+        plan["plugins"].append(entry)
+
+        if options.delete:
+            delete_dir = get_installed_plugin_dir(plugin, platform, installed_dirs, store_index)
+            if delete_dir:
+                installed_dirs.discard(delete_dir)
+                entry["actions"].append({"action": "delete", "path": os.path.join(plugins_dir, delete_dir)})
+            else:
+                entry["actions"].append({"action": "error", "reason": "plugin directory not found"})
+            continue
+
+        build = options.source
+        if not options.prefer_source:
+            actions, installed = plan_binary(plugin, platform, plugins_dir, options, hash_index, store_index)
+            entry["actions"] += actions
+            if installed or any(a["action"] == "error" for a in actions):
+                build = False
+        if build:
+            entry["actions"] += plan_source(plugin, options, build_cache)
+
+    # Determine the expected download sizes via HEAD requests (no payload is transferred).
+    downloads = [a for entry in plan["plugins"] for a in entry["actions"] if a["action"] == "download"]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=options.parallel_downloads) as executor:
+        for action, size in zip(downloads, executor.map(lambda a: get_download_size(a["url"], options.timeout), downloads)):
+            action["bytes"] = size
+
+    actions = [a for entry in plan["plugins"] for a in entry["actions"]]
+    plan["summary"] = {
+        "downloads": len(downloads),
+        "download_bytes": sum(a["bytes"] for a in downloads if a["bytes"] is not None),
+        "unknown_download_sizes": len([a for a in downloads if a["bytes"] is None]),
+        "extracts": len([a for a in actions if a["action"] == "extract"]),
+        "builds": len([a for a in actions if a["action"] == "build"]),
+        "estimated_rebuilds": len([a for a in actions if a["action"] == "build" and a["estimated_rebuild"]]),
+        "deletes": len([a for a in actions if a["action"] == "delete"]),
+        "errors": len([a for a in actions if a["action"] == "error"])
+    }
+    return plan
+
+
+def extract_archive(slug, archive_file, plugin_root, plugins_dir, options, out=None):
+    # Replace the extracted plugin (if any) with the contents of the archive. Returns whether this succeeded.
+    plugin_path = os.path.join(plugins_dir, plugin_root)
+    if os.path.exists(plugin_path) and not options.incremental:
+        shutil.rmtree(plugin_path)
+
+    print("[%s] Extracting..." % slug, end='', flush=True, file=out)
+    try:
+        with timed("extract", slug):
+            if options.incremental:
+                written, unchanged = extract_incremental(archive_file, plugin_root, plugins_dir, options.buffer_size * 1024)
+            else:
+                with zipfile.ZipFile(archive_file) as z:
+                    create_shared_dirs(z, plugin_root, plugins_dir)
+                    z.extractall(plugins_dir)
+        if options.incremental:
+            print("OK (%d files written, %d unchanged)" % (written, unchanged), file=out)
+        else:
+            print("OK", file=out)
+        return True
+    except Exception as e:
+        print("ERROR: Failed to extract module: %s" % e, file=out)
+        # With incremental extraction, the previous version of the plugin is still intact.
+        if not options.incremental and os.path.exists(plugin_path):
+            shutil.rmtree(plugin_path)
+        return False
+
+
+def process_binary(plugin, platform, plugins_dir, options, hash_index, store_index, out=None):
+    slug = plugin['slug']
+    version = plugin['version'] if "version" in plugin.keys() else "UNKNOWN VERSION"
+    result = {"updated": False, "error": False, "warning": False, "installed": False}
+
+    download = True
+
+    #
+    # Binary release available to download?
+    #
+    if "downloads" not in plugin:
+        print("[%s] No binary archive downloads available in repository." % slug, file=out)
+        return result
+
+    #
+    # Binary release available for the selected platform?
+    #
+    if platform not in plugin["downloads"].keys():
+        print("[%s] Binary archive download for platform %s not available." % (slug, PLATFORM_STRING[platform]), file=out)
+        return result
+
+    url = plugin["downloads"][platform]["download"]
+    sha256 = plugin["downloads"][platform]["sha256"] if "sha256" in plugin["downloads"][platform].keys() else None
+
+    # Archives are stored by their checksum. Without one, there is nothing to store (or verify) it by.
+    if not sha256:
+        print("[%s] ERROR: Missing SHA256 checksum in .json file! Skipping module." % slug, file=out)
+        result["error"] = True
+        return result
+    store_file = get_store_file(sha256)
+
+    with get_archive_lock(sha256):
+        #
+        # If the archive is in the store already, check that it is intact (based on SHA256)
+        #
+        if not os.path.exists(store_file):
+            with timed("hash", slug):
+                adopt_legacy_archive(plugin, platform, hash_index, options.verify_all, buffer_size=options.buffer_size * 1024)
+        if os.path.exists(store_file):
+            # If there is a checksum mismatch, the stored archive is corrupt.
+            # Download the archive, which replaces the stored one once verified.
+            with timed("hash", slug):
+                up_to_date = sha256 == cached_hash_sha256(store_file, hash_index, options.verify_all, options.buffer_size * 1024)
+            if up_to_date:
+                print("[%s] Already at newest version. Skipping download." % slug, file=out)
+                download = False
+
+        #
+        # Do we need to download a (potentially newer) version of the plugin?
+        #
+        if download:
+            if options.offline:
+                print("[%s] ERROR: Cannot download version %s in offline mode." % (slug, version), file=out)
+                result["error"] = True
+                return result
+            download_stats = {"bytes": 0}
+            try:
+                print("[%s] Downloading version %s..." % (slug, version), end='', flush=True, file=out)
+                os.makedirs(os.path.dirname(store_file), exist_ok=True)
+                with timed("download", slug):
+                    checksum = download_from_url(url, store_file, sha256, options.buffer_size * 1024,
+                                                 options.retries, options.retry_backoff, options.timeout, download_stats)
+            except ChecksumError as e:
+                print("ERROR: Checksum verification failed", file=out)
+                print("expected: %s" % e.expected, file=out)
+                print("actual:   %s" % e.actual, file=out)
+                result["error"] = True
+                return result
+            except Exception as e:
+                print("ERROR: Failed to download archive for %s: %s" % (slug, e), file=out)
+                result["error"] = True
+                return result
+            finally:
+                record_bytes(download_stats["bytes"], slug)
+
+            record_sha256(store_file, checksum, hash_index)
+            print("OK", file=out)
+
+        add_to_store(store_index, platform, slug, version, sha256)
+
+    #
+    # Update local (extracted) version of the plugin?
+    #
+    plugin_root = get_archive_root(store_index, sha256)
+    plugin_path = os.path.join(plugins_dir, plugin_root)
+
+    # Check if plugin adheres to plugin naming conventions.
+    # Some modules have directory names that do not match the slug.
+    if plugin_root != slug:
+        print("[%s] WARNING: Plugin root folder does not match slug: %s" % (slug, plugin_root), file=out)
+        result["warning"] = True
+
+    # Replace the extracted plugin if we downloaded it or if a different archive was extracted (e.g. after a rollback).
+    current = get_current_archive(store_index, platform, slug)
+    if download or not os.path.exists(plugin_path) or (current and current != sha256):
+        if not extract_archive(slug, store_file, plugin_root, plugins_dir, options, out):
+            if not os.path.exists(plugin_path):
+                set_current_archive(store_index, platform, slug, None)
+            result["error"] = True
+            return result
+        result["updated"] = True
+
+    set_current_archive(store_index, platform, slug, sha256)
+    result["installed"] = True
+    return result
+
+
+def rollback_binary(plugin, platform, plugins_dir, options, hash_index, store_index, out=None):
+    # Extract a previous version of the plugin from the store: the given version (options.rollback)
+    # or the most recently installed version other than the current one. Nothing is downloaded.
+    slug = plugin['slug']
+    result = {"updated": False, "error": False, "warning": False, "installed": False}
+
+    entry = get_store_entry(store_index, platform, slug)
+    current = entry["current"]
+    versions = [(s, e) for s, e in entry["versions"].items() if os.path.exists(get_store_file(s))]
+    if options.rollback:
+        # A version is given by its version string or (a prefix of) its checksum. Prefer the most recently installed.
+        target = [(s, e) for s, e in versions if e["version"] == options.rollback or s.startswith(options.rollback.lower())]
+    else:
+        target = [(s, e) for s, e in versions if s != current and e["installed"]]
+    target.sort(key=lambda x: x[1]["installed"] or 0)
+    if not target:
+        print("[%s] ERROR: %s not available in the archive store. Known versions: %s" % (
+            slug, "Version %s" % options.rollback if options.rollback else "Previous version",
+            ", ".join("%s (%s)" % (e["version"], s[:12]) for s, e in versions) or "-"), file=out)
+        result["error"] = True
+        return result
+    sha256, version = target[-1][0], target[-1][1]["version"]
+    store_file = get_store_file(sha256)
+
+    if sha256 == current:
+        print("[%s] Version %s is installed already." % (slug, version), file=out)
+        result["installed"] = True
+        return result
+
+    with timed("hash", slug):
+        intact = sha256 == cached_hash_sha256(store_file, hash_index, options.verify_all, options.buffer_size * 1024)
+    if not intact:
+        print("[%s] ERROR: Archive of version %s in the archive store is corrupt." % (slug, version), file=out)
+        result["error"] = True
+        return result
+
+    print("[%s] Rolling back to version %s..." % (slug, version), file=out)
+    plugin_root = get_archive_root(store_index, sha256)
+    if not extract_archive(slug, store_file, plugin_root, plugins_dir, options, out):
+        result["error"] = True
+        return result
+
+    with _store_lock:
+        store_index["archives"].setdefault(sha256, {"size": os.path.getsize(store_file)})["last_used"] = time.time()
+    set_current_archive(store_index, platform, slug, sha256)
+    result["updated"] = True
+    result["installed"] = True
+    return result
+
+
+def process_source(plugin, options, build_cache, out=None, log=None, jobserver=None):
+    slug = plugin['slug']
+    result = {"updated": False, "error": False, "cached": False}
+    source_url = plugin["source"] if "source" in plugin.keys() else None
+
+    #
+    # No source code provided. Can't build.
+    #
+    if not source_url:
+        print("[%s] No source URL specified in JSON file. Skipping." % slug, file=out)
+        return result
+
+    try:
+        # Clone the repo if it does not exist.
+        if not os.path.exists(get_source_dir(slug)):
+            print("[%s] Cloning plugin source..." % slug, file=out)
+            with timed("clone", slug):
+                clone_source(slug, source_url, out, log, options.git_cache, options.clone_mode, PLUGIN_COMMITTISH_MAP.get(slug))
+        else:
+            # Fetch updates for local repository.
+            # Skip updating working copy since we might be on a detached head.
+            with timed("fetch", slug):
+                update_source(slug, source_url, fetch_only=True, out=out, log=log)
+
+        # Prepare the repository for building. That means either
+        #  - a hard-coded sha/tag OR
+        #  - the latest git tag OR
+        #  - the HEAD of the master branch
+        committish = PLUGIN_COMMITTISH_MAP[slug] if slug in PLUGIN_COMMITTISH_MAP.keys() else None
+        if not committish:
+            committish = get_latest_git_tag(slug, out, log)
+            if not committish:
+                print("[%s] Updating plugin source..." % slug, file=out)
+                with timed("fetch", slug):
+                    check_out_revision(slug, "master", out, log)
+                    update_source(slug, source_url, out=out, log=log)
+                committish = "HEAD"
+
+        # Skip the build if the revision, its submodules and the toolchain did not change since the last successful build.
+        build_key, revision = get_build_key(slug, committish, log)
+        if not options.clean and slug in build_cache and build_cache[slug]["key"] == build_key and has_build_output(slug):
+            print("[%s] Build of revision %s is up to date. Skipping." % (slug, committish), file=out)
+            result["cached"] = True
+            record_cache("build", True)
+            return result
+        build_cache.pop(slug, None)
+        record_cache("build", False)
+
+        print("[%s] Checking out revision: %s"  % (slug, committish), file=out)
+        with timed("checkout", slug):
+            check_out_revision(slug, committish, out, log)
+
+        # Update git submodules (if applicable)
+        if os.path.exists(os.path.join(get_source_dir(slug), ".gitmodules")):
+            print("[%s] Updating submodules..." % slug, file=out)
+            with timed("submodules", slug):
+                update_submodules(slug, out, log, options.git_cache, options.clone_mode)
+
+        if options.clean:
+            print("[%s] Cleaning build..." % slug, file=out)
+            with timed("clean", slug):
+                clean_build(slug, out, log)
+
+        # Without a jobserver, concurrent builds split the jobs evenly.
+        num_jobs = options.jobs if jobserver else max(1, options.jobs // options.parallel_builds)
+
+        print("[%s] Building plugin..." % slug, file=out)
+        with timed("build", slug):
+            build_source(slug, num_jobs, out, log, jobserver)
+
+        build_cache[slug] = {"key": build_key, "revision": revision}
+        result["updated"] = True
+
+    except Exception:
+        result["error"] = True
+
+    return result
+
+
+def process_source_with_log(plugin, options, build_cache, jobserver, out=None):
+    # Write the output of git and make to a separate log file per plugin.
+    os.makedirs(BUILD_LOG_DIR, exist_ok=True)
+    log_file = get_build_log_file(plugin['slug'])
+    with open(log_file, "w") as log:
+        result = process_source(plugin, options, build_cache, out, log, jobserver)
+    print("[%s] Build log: %s" % (plugin['slug'], log_file), file=out)
+    return result
+
+
+def run_buffered(func, *args):
+    # Collect the console output of a worker so it can be printed in order, without interleaving.
+    out = io.StringIO()
+    result = func(*args, out=out)
+    return result, out.getvalue()
+
+
+def rewrite_manifest(manifest, base_url):
+    # Point the downloads of all archives with a checksum to a mirror.
+    plugins = []
+    for plugin in manifest["plugins"]:
+        if "downloads" in plugin:
+            downloads = {}
+            for platform, download in plugin["downloads"].items():
+                if download.get("sha256"):
+                    download = dict(download, download=base_url + MIRROR_ARCHIVE_PATH + download["sha256"])
+                downloads[platform] = download
+            plugin = dict(plugin, downloads=downloads)
+        plugins.append(plugin)
+    return dict(manifest, plugins=plugins)
+
+
+def get_upstream_manifest(offline, ttl, out=None, mirror=None):
+    # The plugin manifest from the VCV Rack servers or, with the downloads pointing to it, from a mirror.
+    manifest = get_community_plugins(offline, ttl, out, mirror)
+    return rewrite_manifest(manifest, mirror) if mirror else manifest
+
+
+def find_archive(manifest, sha256):
+    # Returns the platform, plugin and (upstream) download of the archive with the given checksum.
+    for plugin in manifest["plugins"]:
+        for platform, download in plugin.get("downloads", {}).items():
+            if download.get("sha256") == sha256:
+                return platform, plugin, download
+    return None
+
+
+def parse_range(header, size):
+    # Returns the (first, last) byte of a single "bytes=" range, None for the whole file
+    # or False if the range cannot be satisfied.
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip()) if header else None
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if not match.group(1):
+        first, last = max(0, size - int(match.group(2))), size - 1
+    else:
+        first, last = int(match.group(1)), min(size - 1, int(match.group(2)) if match.group(2) else size - 1)
+    return (first, last) if first <= last else False
+
+
+def fetch_archive(fetch, url, store_file, options):
+    # Download an archive for the mirror into a temporary file. Requests for the archive stream it from there
+    # while it is written (fetch["written"] bytes so far). Once it is complete and no request reads it anymore,
+    # it is moved into the store (if verified). Returns None or the error that occurred.
+    cond = fetch["cond"]
+    part_file = store_file + ".part"
+    checksum = hashlib.sha256()
+    buffer = memoryview(bytearray(options.buffer_size * 1024))
+    error = None
+    try:
+        os.makedirs(os.path.dirname(store_file), exist_ok=True)
+        with open(part_file, "wb") as f:
+            attempt = 0
+            while True:
+                try:
+                    headers = {"Range": "bytes=%d-" % fetch["written"]} if fetch["written"] else None
+                    with open_url(url, headers, timeout=options.timeout) as response:
+                        # Skip what was written already if the server ignored the range request.
+                        skip = fetch["written"] if response.status != 206 else 0
+                        if fetch["size"] is None:
+                            with cond:
+                                fetch["size"] = response.length
+                                fetch["started"] = True
+                                cond.notify_all()
+                        while True:
+                            num_bytes = response.readinto(buffer)
+                            if not num_bytes:
+                                break
+                            data = buffer[min(skip, num_bytes):num_bytes]
+                            skip -= num_bytes - len(data)
+                            if data:
+                                checksum.update(data)
+                                f.write(data)
+                                f.flush()
+                                with cond:
+                                    fetch["written"] += len(data)
+                                    cond.notify_all()
+                        if response.length:
+                            raise http.client.IncompleteRead(b"", response.length)
+                    break
+                except urllib.error.HTTPError as e:
+                    if attempt >= options.retries or (e.code < 500 and e.code != 429):
+                        raise
+                except (OSError, http.client.HTTPException):
+                    if attempt >= options.retries:
+                        raise
+                time.sleep(options.retry_backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+                attempt += 1
+        if checksum.hexdigest() != fetch["sha256"]:
+            error = ChecksumError(fetch["sha256"], checksum.hexdigest())
+    except Exception as e:
+        error = e
+
+    with cond:
+        fetch["error"] = error
+        fetch["done"] = True
+        cond.notify_all()
+        # The temporary file cannot be moved while it is open (on Windows).
+        while fetch["readers"]:
+            cond.wait()
+    if error is None:
+        os.replace(part_file, store_file)
+    elif isinstance(error, ChecksumError):
+        os.makedirs(FAILED_CHECKSUM_DIR, exist_ok=True)
+        shutil.move(part_file, os.path.join(FAILED_CHECKSUM_DIR, os.path.basename(store_file)))
+    return error
+
+
+class MirrorHandler(http.server.BaseHTTPRequestHandler):
+    # Serves the plugin manifest at /community/plugins (with the downloads pointing to this mirror)
+    # and archives at /archives/<sha256>. Archives not in the store are fetched from upstream (once) and streamed
+    # to all clients requesting them while they are fetched. They are only added to the store once verified.
+    protocol_version = "HTTP/1.1"
+    server_version = "vcv-plugindownloader/%s" % __version__
+    # Do not let a stalled client hold up the fetched archive it is reading.
+    timeout = DOWNLOAD_TIMEOUT
+
+    def log(self, message):
+        # A single write, so that the lines of concurrent requests do not interleave.
+        print("[mirror] %s\n" % message, end='', flush=True, file=self.server.out)
+
+    def log_message(self, format, *args):
+        self.log("%s %s" % (self.address_string(), format % args))
+
+    def do_HEAD(self):
+        self.handle_request(head=True)
+
+    def do_GET(self):
+        self.handle_request(head=False)
+
+    def handle_request(self, head):
+        path = urllib.parse.urlsplit(self.path).path
+        if path == "/community/plugins":
+            self.send_manifest(head)
+        elif path.startswith(MIRROR_ARCHIVE_PATH) and re.fullmatch(r"[0-9a-f]{64}", path[len(MIRROR_ARCHIVE_PATH):]):
+            self.send_archive(path[len(MIRROR_ARCHIVE_PATH):], head)
+        else:
+            self.send_error(404)
+
+    def get_manifest(self):
+        # The upstream manifest, only rewritten (for --mirror) when the cached manifest changed. Call with state["lock"] held.
+        state = self.server.state
+        options = state["options"]
+        manifest = get_community_plugins(options.offline, options.manifest_ttl, self.server.out, state["mirror"])
+        if state["upstream"] is not manifest:
+            state.update(upstream=manifest, manifest=rewrite_manifest(manifest, state["mirror"]) if state["mirror"] else manifest)
+        return state["manifest"]
+
+    def send_body(self, status, headers, body=b"", head=False):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def send_manifest(self, head):
+        state = self.server.state
+        base_url = "http://%s" % (self.headers.get("Host") or "%s:%d" % self.server.server_address[:2])
+        try:
+            with state["lock"]:
+                manifest = self.get_manifest()
+                # Only serialize the manifest again if it changed.
+                if state["served"] is not manifest or state["base_url"] != base_url:
+                    body = json.dumps(rewrite_manifest(manifest, base_url)).encode("utf-8")
+                    state.update(served=manifest, base_url=base_url, body=body, etag='"%s"' % hashlib.sha256(body).hexdigest()[:32])
+                body, etag = state["body"], state["etag"]
+        except Exception as e:
+            self.send_error(502, "Failed to get plugin manifest: %s" % e)
+            return
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_body(304, {"ETag": etag, "Content-Length": "0"}, head=True)
+            return
+        self.send_body(200, {"Content-Type": "application/json", "ETag": etag, "Content-Length": str(len(body))}, body, head)
+
+    def send_archive(self, sha256, head):
+        state = self.server.state
+        options = state["options"]
+        store_file = get_store_file(sha256)
+
+        with get_archive_lock(sha256):
+            available = os.path.exists(store_file) and sha256 == cached_hash_sha256(store_file, state["hash_index"], buffer_size=options.buffer_size * 1024)
+            if available:
+                with _store_lock:
+                    state["store_index"]["archives"].setdefault(sha256, {"size": os.path.getsize(store_file)})["last_used"] = time.time()
+        if available:
+            self.send_file(store_file, head)
+            return
+
+        try:
+            with state["lock"]:
+                manifest = self.get_manifest()
+        except Exception as e:
+            self.send_error(502, "Failed to get plugin manifest: %s" % e)
+            return
+        archive = find_archive(manifest, sha256)
+        if not archive or options.offline:
+            self.send_error(404)
+            return
+        platform, plugin, download = archive
+        # Report the size of the upstream archive without fetching it.
+        if head:
+            size = get_download_size(download["download"], options.timeout)
+            if size is None:
+                self.send_error(404)
+            else:
+                self.send_body(200, {"Content-Type": "application/zip", "Content-Length": str(size)}, head=True)
+            return
+
+        fetch = self.get_fetch(sha256, platform, plugin, download)
+        if fetch is None:
+            # Fetched and added to the store in the meantime.
+            self.send_file(store_file, head)
+            return
+        self.send_fetched_archive(fetch, store_file)
+
+    def get_fetch(self, sha256, platform, plugin, download):
+        # Returns the fetch of the archive from upstream, which is started unless it is in progress already,
+        # or None if the archive is in the store (anymore).
+        state = self.server.state
+        with state["lock"]:
+            if sha256 in state["fetches"]:
+                return state["fetches"][sha256]
+            if os.path.exists(get_store_file(sha256)):
+                return None
+            fetch = {"sha256": sha256, "cond": threading.Condition(), "size": None, "written": 0, "readers": 0,
+                     "started": False, "done": False, "finished": False, "error": None}
+            state["fetches"][sha256] = fetch
+
+        def run_fetch():
+            self.log("[%s] Fetching %s archive from upstream..." % (plugin["slug"], PLATFORM_STRING[platform]))
+            store_file = get_store_file(sha256)
+            with timed("download", plugin["slug"]):
+                error = fetch_archive(fetch, download["download"], store_file, state["options"])
+            if error is None:
+                with get_archive_lock(sha256):
+                    record_sha256(store_file, sha256, state["hash_index"])
+                    add_to_store(state["store_index"], platform, plugin["slug"], plugin.get("version", sha256[:12]), sha256)
+            else:
+                self.log("[%s] ERROR: Failed to fetch archive: %s" % (plugin["slug"], error))
+            with state["lock"]:
+                del state["fetches"][sha256]
+            with fetch["cond"]:
+                fetch["finished"] = True
+                fetch["cond"].notify_all()
+
+        threading.Thread(target=run_fetch, daemon=True).start()
+        return fetch
+
+    def send_fetched_archive(self, fetch, store_file):
+        # Stream the archive from the temporary file of the fetch, as far as it is written.
+        cond = fetch["cond"]
+        with cond:
+            while not fetch["started"] and not fetch["done"]:
+                cond.wait()
+            # Without the size of the archive (or once it was fetched completely) wait until it is in the store.
+            wait = fetch["done"] or fetch["size"] is None
+            while wait and not fetch["finished"]:
+                cond.wait()
+            if not wait:
+                fetch["readers"] += 1
+        if wait:
+            if fetch["error"] is None:
+                self.send_file(store_file, False)
+            else:
+                self.send_error(502, "Failed to fetch archive: %s" % fetch["error"])
+            return
+
+        try:
+            first, last = self.send_headers(fetch["size"], fetch["sha256"])
+            if first is None:
+                return
+            buffer = memoryview(bytearray(self.server.state["options"].buffer_size * 1024))
+            position = first
+            with open(store_file + ".part", "rb") as f:
+                f.seek(first)
+                while position <= last:
+                    with cond:
+                        while fetch["written"] <= position and not fetch["done"]:
+                            cond.wait()
+                        written = fetch["written"]
+                    if written <= position:
+                        break
+                    num_bytes = f.readinto(buffer[:min(last + 1, written) - position])
+                    if not num_bytes:
+                        break
+                    self.wfile.write(buffer[:num_bytes])
+                    position += num_bytes
+                    record_bytes(num_bytes)
+            # The fetch failed: the client only got part of the archive.
+            if position <= last:
+                self.close_connection = True
+        finally:
+            with cond:
+                fetch["readers"] -= 1
+                cond.notify_all()
+
+    def send_headers(self, size, sha256):
+        # Send the headers for the (range of the) archive requested. Returns the first and last byte to send,
+        # or None, None if the range cannot be satisfied.
+        byte_range = parse_range(self.headers.get("Range"), size)
+        if byte_range is False:
+            self.send_body(416, {"Content-Range": "bytes */%d" % size, "Content-Length": "0"}, head=True)
+            return None, None
+        first, last = byte_range or (0, size - 1)
+        headers = {"Content-Type": "application/zip", "Accept-Ranges": "bytes", "Content-Length": str(last - first + 1), "ETag": '"%s"' % sha256}
+        if byte_range:
+            headers["Content-Range"] = "bytes %d-%d/%d" % (first, last, size)
+        self.send_body(206 if byte_range else 200, headers, head=True)
+        return first, last
+
+    def send_file(self, store_file, head):
+        first, last = self.send_headers(os.path.getsize(store_file), os.path.basename(store_file)[:-len(".zip")])
+        if head or first is None:
+            return
+
+        buffer = memoryview(bytearray(self.server.state["options"].buffer_size * 1024))
+        remaining = last - first + 1
+        with open(store_file, "rb") as f:
+            f.seek(first)
+            while remaining > 0:
+                num_bytes = f.readinto(buffer[:min(remaining, len(buffer))])
+                if not num_bytes:
+                    break
+                self.wfile.write(buffer[:num_bytes])
+                remaining -= num_bytes
+                record_bytes(num_bytes)
+
+
+def serve_mirror(address, options, hash_index, store_index, out=None, mirror=None):
+    # Serves the mirror on [HOST:]PORT until interrupted (Ctrl+C).
+    host, _, port = address.rpartition(":")
+    server = http.server.ThreadingHTTPServer((host or "0.0.0.0", int(port)), MirrorHandler)
+    server.daemon_threads = True
+    server.out = out
+    server.state = {"options": options, "hash_index": hash_index, "store_index": store_index,
+                    "lock": threading.Lock(), "mirror": mirror, "upstream": None, "manifest": None,
+                    "served": None, "base_url": None, "body": None, "etag": None, "fetches": {}}
+    print("Serving mirror on http://%s:%d/ (press Ctrl+C to stop)..." % server.server_address[:2], file=out, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Mirror stopped.", file=out)
+    finally:
+        server.server_close()
+
+
+def get_plugins_dirs(platforms, plugins_dir):
+    # Several platforms are synced into a subdirectory per platform.
+    if len(platforms) > 1:
+        return {platform: os.path.join(plugins_dir, platform) for platform in platforms}
+    return {platforms[0]: plugins_dir}
+
+
+def select_plugins(args, community_plugins, plugins_dirs, patch_files=None, out=None):
+    # Selects the plugins to process from the manifest: plugins found in the plugins directories (-u),
+    # plugins used by patch files (-p) or the plugins given by -i (all by default), without those given by -x.
+    # Returns the selected plugins and None, or None and the exit code if there is nothing (more) to do.
+    plugin_index, slug_lookup = build_plugin_index(community_plugins)
+
+    # Build a list of plugins to download.
+    plugins = []
+
+    # If update is specified on command line, get list of plugins in plugins directory.
+    if args.update:
+        p_list = set(p.split(".")[0] for plugins_dir in plugins_dirs.values() if os.path.isdir(plugins_dir)
+                     for p in os.listdir(plugins_dir)) & plugin_index.keys()
+        plugins = [plugin_index[pl] for pl in sorted(p_list)]
+
+    # If patch file is specified on command line, get the list of plugins from the patch.
+    elif args.patch:
+        patch_cache = load_patch_cache()
+        saved_patch_cache = dict(patch_cache)
+        with timed("patch"):
+            plugins_per_patch = get_plugins_from_patch_files(patch_files, patch_cache, out)
+        if patch_cache != saved_patch_cache and not args.plan:
+            save_patch_cache(patch_cache)
+
+        # Filter out certain Rack stock plugins, that we don't want to download.
+        for pf in plugins_per_patch:
+            plugins_per_patch[pf] = [p for p in plugins_per_patch[pf] if not p in ["Core", "Fundamental"]]
+        patch_plugins = sorted(set().union(*plugins_per_patch.values()))
+
+        if not patch_plugins:
+            print("No plugins to download for patch files: %s" % ", ".join(patch_files), file=out)
+            return None, 0
+
+        if len(patch_files) > 1:
+            print("Modules required by patch files:", file=out)
+            for pf, pf_plugins in plugins_per_patch.items():
+                print("%s: %s" % (pf, ", ".join(pf_plugins) if pf_plugins else "-"), file=out)
+            print("", file=out)
+            print("Modules found in %d patch files:" % len(patch_files), file=out)
+        else:
+            print("Modules found in patch file '%s':" % patch_files[0], file=out)
+        print(", ".join(patch_plugins), file=out)
+        print("", file=out)
+
+        for pp in patch_plugins:
+            if pp not in plugin_index:
+                print("[%s] ERROR: Plugin not found in Community repository. Skipping." % pp, file=out)
+                continue
+            plugins.append(plugin_index[pp])
+
+    # Any plugins specified on command line?
+    elif args.include:
+        selected = {}
+        for pi in args.include:
+            try:
+                matches = match_plugins(pi, plugin_index, slug_lookup)
+            except re.error as e:
+                print("[%s] ERROR: Invalid regular expression: %s" % (pi, e), file=out)
+                return None, 1
+            if not matches:
+                print("[%s] ERROR: Invalid plugin name" % pi, file=out)
+                return None, 1
+            selected.update((slug, plugin_index[slug]) for slug in matches)
+        plugins = list(selected.values())
+
+    # Assume to download ALL plugins from community repository.
+    else:
+        plugins = community_plugins
+
+    # Filter out any excluded plugins (if applicable)
+    if args.exclude:
+        excluded = set()
+        for px in args.exclude:
+            try:
+                matches = match_plugins(px, plugin_index, slug_lookup)
+            except re.error as e:
+                print("[%s] ERROR: Invalid regular expression: %s" % (px, e), file=out)
+                return None, 1
+            if not matches:
+                print("[%s] ERROR: Invalid plugin name" % px, file=out)
+                return None, 1
+            excluded.update(matches)
+        plugins = [p for p in plugins if p["slug"] not in excluded]
+
+    return plugins, None
+
+
+def create_report(args, exit_code):
+    duration = time.time() - run_stats["started"]
+    download_seconds = run_stats["phases"].get("download", {}).get("seconds", 0)
+
+    plugins = {}
+    for slug, stats in run_stats["plugins"].items():
+        plugin_download_seconds = stats["phases"].get("download", 0)
+        plugins[slug] = dict(stats, throughput=stats["bytes"] / plugin_download_seconds if plugin_download_seconds else None)
+
+    return {
+        "version": __version__,
+        "platforms": args.platform,
+        "started": datetime.datetime.fromtimestamp(run_stats["started"], datetime.timezone.utc).isoformat(),
+        "duration": duration,
+        "exit_code": exit_code,
+        "phases": run_stats["phases"],
+        "bytes": run_stats["bytes"],
+        # Bytes per second of download time, summed over all (possibly concurrent) downloads.
+        "throughput": run_stats["bytes"] / download_seconds if download_seconds else None,
+        "cache": run_stats["cache"],
+        "connections": dict(connection_stats),
+        "result": run_stats.get("result", {}),
+        "plugins": plugins
+    }
+
+
+#
+# Library API, e.g. to run many syncs in one process. Uses the same code path as the command line.
+# The manifest cache and idle HTTP connections are kept between calls (see close()).
+# Calls are serialized, as they share the download directory (see set_download_dir()) and the run statistics.
+#
+
+SyncResult = collections.namedtuple("SyncResult", ["exit_code", "updated", "cached", "errors", "warnings", "report"])
+
+_api_lock = threading.Lock()
+
+
+class ProgressWriter(io.TextIOBase):
+    # File-like object passing each line of output to a callback.
+
+    def __init__(self, callback):
+        super().__init__()
+        self.callback = callback
+        self.pending = ""
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        lines = (self.pending + text).split("\n")
+        self.pending = lines.pop()
+        for line in lines:
+            self.callback(line)
+        return len(text)
+
+    def close(self):
+        if self.pending:
+            self.callback(self.pending)
+            self.pending = ""
+        super().close()
+
+
+def get_api_args(platforms, options):
+    # Command line arguments for the given platform(s) and options (named like the command line options, e.g. parallel_downloads=8).
+    platforms = [platforms] if isinstance(platforms, str) else list(platforms)
+    if not platforms or any(p not in PLATFORM_STRING for p in platforms):
+        raise ValueError("Invalid platforms: %s (valid platforms: %s)" % (", ".join(platforms), ", ".join(PLATFORM_STRING)))
+    args = parse_args(platforms)
+    for name, value in options.items():
+        if name in ("platform", "plan", "report", "profile", "serve") or not hasattr(args, name):
+            raise TypeError("Invalid option: %s" % name)
+        setattr(args, name, value)
+    if args.delete and not args.yes:
+        raise ValueError("Deleting plugins requires yes=True")
+    return args
+
+
+@contextlib.contextmanager
+def api_call(progress, download_dir):
+    # Serializes calls. Yields the output stream and the list of lines written to it so far,
+    # each of which is also passed to progress (if given).
+    lines = []
+
+    def on_line(line):
+        lines.append(line)
+        if progress:
+            progress(line)
+
+    with _api_lock:
+        if download_dir:
+            set_download_dir(download_dir)
+        reset_run_stats()
+        out = ProgressWriter(on_line)
+        try:
+            yield out, lines
+        finally:
+            out.close()
+
+
+def resolve_plugins(platforms, plugins_dir=None, download_dir=None, progress=None, **options):
+    # Returns the manifest entries of the plugins selected by the options (include, exclude, patch, update).
+    args = get_api_args(platforms, options)
+    plugins_dirs = get_plugins_dirs(list(dict.fromkeys(args.platform)), os.path.abspath(plugins_dir or os.getcwd()))
+
+    with api_call(progress, download_dir) as (out, lines):
+        patch_files = find_patch_files(args.patch, out) if args.patch else None
+        if args.patch and not patch_files:
+            raise ValueError(lines[-1] if lines else "No patch files found in: %s" % ", ".join(args.patch))
+        community_plugins = get_upstream_manifest(args.offline, args.manifest_ttl, out, args.mirror.rstrip("/") if args.mirror else None)["plugins"]
+        plugins, exit_code = select_plugins(args, community_plugins, plugins_dirs, patch_files, out)
+        if exit_code:
+            raise ValueError(lines[-1])
+    return plugins or []
+
+
+def plan(platforms, plugins_dir=None, download_dir=None, progress=None, **options):
+    # Returns the sync plan (see --plan) without changing anything. Raises RuntimeError if no plan could be computed.
+    args = get_api_args(platforms, options)
+    args.plan = "-"
+    plans = []
+    with api_call(progress, download_dir) as (out, lines):
+        exit_code = run(args, out, plugins_dir, plans.append, keep_connections=True)
+        if not plans:
+            raise RuntimeError(lines[-1] if exit_code and lines else "Nothing to plan (exit code %d)" % exit_code)
+    return plans[0]
+
+
+def sync(platforms, plugins_dir=None, download_dir=None, progress=None, **options):
+    # Syncs the plugins of the given platform(s) to plugins_dir (default: the working directory) and returns a SyncResult.
+    # The exit code is the one of the command line. The report is the one written by --report.
+    args = get_api_args(platforms, options)
+    with api_call(progress, download_dir) as (out, lines):
+        exit_code = run(args, out, plugins_dir, keep_connections=True)
+        result = run_stats.get("result", {})
+        return SyncResult(exit_code, result.get("updated", []), result.get("cached", []), result.get("errors", []),
+                          result.get("warnings", []), create_report(args, exit_code))
+
+
+async def async_sync(platforms, plugins_dir=None, download_dir=None, progress=None, **options):
+    # sync() on a worker thread. progress is called on that thread.
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(sync, platforms, plugins_dir, download_dir, progress, **options))
+
+
+def close():
+    # Closes idle HTTP connections kept between calls.
+    close_connections()
+
+
+def main(argv=None):
+
+    # Argument handling
+    args = parse_args(argv)
+
+    reset_run_stats()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+
+    try:
+        # The plan is written to stdout. Print everything else to stderr.
+        exit_code = run(args, sys.stderr if args.plan == "-" else None)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(create_report(args, exit_code), f, indent=2)
+
+    return exit_code
+
+
+def run(args, out=None, plugins_dir=None, plan_callback=None, keep_connections=False):
+    # Runs the command line (args as returned by parse_args()) against plugins_dir (default: the working directory),
+    # printing progress to out. A plan (--plan) is passed to plan_callback instead of being written out, if given.
+    global HTTP_POOL_SIZE
+
+    platforms = list(dict.fromkeys(args.platform))
+    build_from_source = args.source
+    prefer_source = args.prefer_source
+    num_jobs = args.jobs
+    delete = args.delete
+    assume_yes = args.yes
+    patch_paths = args.patch
+    parallel_downloads = args.parallel_downloads
+    plugins_dir = os.path.abspath(plugins_dir or os.getcwd())
+    plugins_dirs = get_plugins_dirs(platforms, plugins_dir)
+    HTTP_POOL_SIZE = args.pool_size
+    offline = args.offline
+    # git resolves a relative reference repository against the plugin checkout (for submodules).
+    if args.git_cache:
+        args.git_cache = os.path.abspath(args.git_cache)
+
+    print("VCV Plugin Downloader v%s" % __version__, file=out)
+    print("Platform: %s" % ", ".join(PLATFORM_STRING[platform] for platform in platforms), file=out)
+    print("", file=out)
+
+    update_list = []
+    cached_list = []
+    error_list = []
+    warning_list = []
+
+    pending_downloads = {}
+    pending_builds = []
+    executor = None
+    trash_dirs = [os.path.join(plugins_dir, TRASH_DIR_NAME) for plugins_dir in plugins_dirs.values()]
+    build_executor = None
+    jobserver = None
+    hash_index = load_hash_index()
+    saved_hash_index = dict(hash_index)
+    store_index = load_store_index()
+    saved_store_index = json.dumps(store_index, sort_keys=True)
+    build_cache = load_build_cache()
+    saved_build_cache = dict(build_cache)
+
+    git_available = check_git(out)
+
+    if not git_available and build_from_source:
+        print("ERROR: Building from source requires 'git' to be installed. Aborting.", file=out)
+        return 1
+
+    if parallel_downloads < 1 or args.parallel_builds < 1:
+        print("ERROR: Number of parallel downloads and builds must be at least 1. Aborting.", file=out)
+        return 1
+
+    if args.buffer_size < 1:
+        print("ERROR: Buffer size must be at least 1 KiB. Aborting.", file=out)
+        return 1
+
+    patch_files = None
+    if patch_paths:
+        patch_files = find_patch_files(patch_paths, out)
+        if patch_files is None:
+            return 1
+        if not patch_files:
+            print("ERROR: No patch files found in: %s. Aborting." % ", ".join(patch_paths), file=out)
+            return 1
+
+    if offline and build_from_source:
+        print("ERROR: Building from source is not supported in offline mode. Aborting.", file=out)
+        return 1
+
+    if len(platforms) > 1 and (build_from_source or prefer_source):
+        print("ERROR: Building from source is not supported for several platforms. Aborting.", file=out)
+        return 1
+
+    # Plugin sources are cloned to and built in the working directory.
+    if (build_from_source or prefer_source) and plugins_dir != os.getcwd():
+        print("ERROR: Building from source requires the plugins directory to be the working directory. Aborting.", file=out)
+        return 1
+
+    if args.rollback is not None and (delete or prefer_source or args.plan):
+        print("ERROR: --rollback cannot be combined with --delete, --prefer-source or --plan. Aborting.", file=out)
+        return 1
+
+    mirror = args.mirror.rstrip("/") if args.mirror else None
+
+    # Serve the archive store to other machines (if requested).
+    if args.serve:
+        try:
+            serve_mirror(args.serve, args, hash_index, store_index, out, mirror)
+        except (OSError, ValueError) as e:
+            print("ERROR: Failed to serve mirror on '%s': %s. Aborting." % (args.serve, e), file=out)
+            return 1
+        finally:
+            save_store_index(store_index)
+            save_hash_index(hash_index)
+            close_connections()
+        return 0
+
+    # Garbage collection of the archive store (if requested).
+    if args.gc:
+        max_size = args.max_store_size * 1024 * 1024 if args.max_store_size is not None else None
+        with timed("gc"):
+            evicted, evicted_size = collect_garbage(store_index, max_size, args.max_store_age)
+        save_store_index(store_index)
+        save_hash_index(hash_index)
+        store_size = sum(a["size"] for a in store_index["archives"].values())
+        print("Evicted %d archives (%.1f MiB) from the archive store. %d archives (%.1f MiB) remaining." % (
+            evicted, evicted_size / (1024 * 1024), len(store_index["archives"]), store_size / (1024 * 1024)), file=out)
+        return 0
+
+    try:
+        # A plan is computed from the cached manifest (if there is one).
+        use_cached_manifest = offline or (args.plan and get_manifest_cache(mirror) is not None)
+        with timed("manifest"):
+            community_plugins = get_upstream_manifest(use_cached_manifest, args.manifest_ttl, out, mirror)["plugins"]
+    except Exception as e:
+        print("ERROR: Failed to get plugin manifest: %s. Aborting." % e, file=out)
+        return 1
+
+    try:
+        # Print list of available plugins
+        if args.list:
+            print("Available plugins in Community repository:", file=out)
+            print(", ".join([p["slug"] for p in community_plugins]), file=out)
+            return 0
+
+        plugins, exit_code = select_plugins(args, community_plugins, plugins_dirs, patch_files, out)
+        if exit_code is not None:
+            return exit_code
+
+        # Compute the sync plan without changing anything (if requested).
+        if args.plan:
+            plans = [create_plan(plugins, platform, plugins_dir, args, dict(hash_index), store_index, build_cache)
+                     for platform, plugins_dir in plugins_dirs.items()]
+            if len(plans) == 1:
+                plan = plans[0]
+            else:
+                plan = {"version": __version__, "platforms": plans,
+                        "summary": {key: sum(p["summary"][key] for p in plans) for key in plans[0]["summary"]}}
+            if plan_callback:
+                plan_callback(plan)
+            elif args.plan == "-":
+                json.dump(plan, sys.stdout, indent=2)
+                sys.stdout.write("\n")
+            else:
+                with open(args.plan, "w") as f:
+                    json.dump(plan, f, indent=2)
+                summary = plan["summary"]
+                print("Plan written to '%s': %d downloads (%d bytes), %d extracts, %d builds (%d estimated rebuilds), %d deletes, %d errors" % (
+                    args.plan, summary["downloads"], summary["download_bytes"], summary["extracts"], summary["builds"],
+                    summary["estimated_rebuilds"], summary["deletes"], summary["errors"]), file=out)
+            return 0
+
+        # Housekeeping
+        if not os.path.exists(DOWNLOAD_DIR):
+            os.mkdir(DOWNLOAD_DIR)
+        if os.path.exists(FAILED_CHECKSUM_DIR):
+            shutil.rmtree(FAILED_CHECKSUM_DIR)
+        for plugins_dir in plugins_dirs.values():
+            os.makedirs(plugins_dir, exist_ok=True)
+
+        # Confirm deletion (if requested).
+        if delete and not assume_yes:
+            print("Are you sure you want to DELETE the following plugins?\n", file=out)
+            print(" ".join(p["slug"] for p in plugins), file=out)
+            confirm = input("\nPlease confirm [yes|no]: ")
+            if confirm.lower() not in ["yes", "no"]:
+                print("Invalid choice. Aborting.", file=out)
+                return 1
+            if confirm.lower() != "yes":
+                print("Delete cancelled.", file=out)
+                return 0
+
+        #
+        # Download, verify and extract binary releases on a worker pool (if requested).
+        # Results are collected per platform and plugin and reported in order below.
+        #
+        if parallel_downloads > 1 and not delete and not prefer_source and args.rollback is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=parallel_downloads)
+            for platform, plugins_dir in plugins_dirs.items():
+                for plugin in plugins:
+                    pending_downloads[(platform, plugin["slug"])] = executor.submit(run_buffered, process_binary, plugin, platform, plugins_dir, args, hash_index, store_index)
+
+        #
+        # Build plugins from source on a worker pool (if requested). All builds share a budget of
+        # make jobs, git operations of one plugin overlap with builds of other plugins.
+        #
+        if build_from_source and args.parallel_builds > 1 and not delete:
+            build_executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.parallel_builds)
+            jobserver = create_jobserver(num_jobs)
+
+        #
+        # Process all plugins in our assembled list, for each platform.
+        #
+        for platform in platforms:
+            plugins_dir = plugins_dirs[platform]
+            if len(platforms) > 1:
+                if platform != platforms[0]:
+                    print("", file=out)
+                print("Platform: %s (%s)" % (PLATFORM_STRING[platform], plugins_dir), file=out)
+                print("", file=out)
+
+            # List the plugins directory once to look up the directories of the plugins to delete.
+            installed_dirs = set(os.listdir(plugins_dir)) if delete else None
+
+            for plugin in plugins:
+
+                slug = plugin['slug']
+                label = slug if len(platforms) == 1 else "%s (%s)" % (slug, PLATFORM_STRING[platform])
+                version = plugin['version'] if "version" in plugin.keys() else "UNKNOWN VERSION"
+
+                print("[%s] Version %s" % (slug, version), file=out)
+
+                #
+                # Plugin deletion requested?
+                #
+                if delete:
+
+                    delete_dir = get_installed_plugin_dir(plugin, platform, installed_dirs, store_index)
+                    if delete_dir:
+                        print("[%s] Deleting plugin directory '%s'..." % (slug, delete_dir), end='', flush=True, file=out)
+                        try:
+                            move_to_trash(os.path.join(plugins_dir, delete_dir), os.path.join(plugins_dir, TRASH_DIR_NAME))
+                            installed_dirs.discard(delete_dir)
+                            set_current_archive(store_index, platform, slug, None)
+                            print("OK", file=out)
+                        except Exception as e:
+                            print("ERROR: Failed to remove plugin: %s" % e, file=out)
+                    else:
+                        print("[%s] ERROR: Plugin directory not found" % slug, file=out)
+                    continue
+
+                #
+                # Rollback to a version in the archive store requested?
+                #
+                if args.rollback is not None:
+                    result = rollback_binary(plugin, platform, plugins_dir, args, hash_index, store_index, out)
+                    if result["error"]:
+                        error_list.append(label)
+                    elif result["updated"]:
+                        update_list.append(label)
+                    continue
+
+                build = build_from_source
+
+                #
+                # Skip binary download if building source is preferred.
+                #
+                if not prefer_source:
+                    if (platform, slug) in pending_downloads:
+                        result, output = pending_downloads[(platform, slug)].result()
+                        print(output, end='', flush=True, file=out)
+                    else:
+                        result = process_binary(plugin, platform, plugins_dir, args, hash_index, store_index, out)
+
+                    if result["warning"]:
+                        warning_list.append(label)
+                    if result["error"]:
+                        error_list.append(label)
+                        continue
+                    if result["updated"]:
+                        update_list.append(label)
+
+                    # Plugin downloaded and extracted successfully. No need to build from source.
+                    if result["installed"]:
+                        build = False
+
+                #
+                # Build plugin from source?
+                #
+                if build:
+                    if build_executor:
+                        pending_builds.append((slug, build_executor.submit(run_buffered, process_source_with_log, plugin, args, build_cache, jobserver)))
+                        continue
+
+                    result = process_source(plugin, args, build_cache, out)
+                    if result["error"]:
+                        error_list.append(label)
+                    elif result["updated"]:
+                        update_list.append(label)
+                    elif result["cached"]:
+                        cached_list.append(label)
+
+        #
+        # Report results of concurrent builds (if applicable) in order.
+        #
+        for slug, future in pending_builds:
+            result, output = future.result()
+            print(output, end='', flush=True, file=out)
+            if result["error"]:
+                error_list.append(slug)
+            elif result["updated"]:
+                update_list.append(slug)
+            elif result["cached"]:
+                cached_list.append(slug)
+
+        # Remove annoying "__MACOSX" directory for all non-Mac platforms, if it exists.
+        for platform, plugins_dir in plugins_dirs.items():
+            annoying_mac_dir = os.path.join(plugins_dir, "__MACOSX")
+            if platform != "mac" and os.path.exists(annoying_mac_dir):
+                shutil.rmtree(annoying_mac_dir)
+
+        run_stats["result"] = {"updated": update_list, "cached": cached_list, "errors": error_list, "warnings": warning_list}
+
+        if update_list:
+            print("", file=out)
+            print("PLUGINS UPDATED: %s" % ", ".join(update_list), file=out)
+
+        if cached_list:
+            print("", file=out)
+            print("PLUGINS CACHED: %s" % ", ".join(cached_list), file=out)
+
+        if error_list:
+            print("", file=out)
+            print("PLUGINS WITH ERRORS: %s" % ", ".join(error_list), file=out)
+
+        if warning_list:
+            print("", file=out)
+            print("PLUGINS WITH WARNINGS: %s" % ", ".join(warning_list), file=out)
+
+        if connection_stats["opened"] or connection_stats["reused"]:
+            print("", file=out)
+            print("CONNECTIONS: %d opened, %d reused (%d handshakes saved)" % (connection_stats["opened"], connection_stats["reused"], connection_stats["reused"]), file=out)
+
+        if error_list:
+            return 1
+        if warning_list:
+            return 2
+
+        return 0
+
+    except Exception as e:
+        print("Exception: %s" % e, file=out)
+        traceback.print_exc(file=sys.stderr)
+        return 1
+
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+        if build_executor:
+            build_executor.shutdown(cancel_futures=True)
+            close_jobserver(jobserver)
+        if not args.plan:
+            # Deleted plugin directories are removed in the background, without waiting for it.
+            # Whatever is left (e.g. if the removal is interrupted) is removed on the next run.
+            for trash_dir in trash_dirs:
+                try:
+                    empty_trash(trash_dir)
+                except OSError:
+                    pass
+        if not keep_connections:
+            close_connections()
+        if hash_index != saved_hash_index:
+            save_hash_index(hash_index)
+        if not args.plan and json.dumps(store_index, sort_keys=True) != saved_store_index:
+            save_store_index(store_index)
+        if build_cache != saved_build_cache:
+            save_build_cache(build_cache)
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))